@@ -6,7 +6,8 @@ Note that in both instances, we use the same seeds for each player-arm pair.
 import numpy as np
 
 from matching.cetralised_platforms.pac.BasePlatform import BasePlatform
-from matching.matching_algo.gale_shapley import gale_shapley_algo
+from matching.matching_algo.gale_shapley import batched_gale_shapley
+from matching.utils import preferences_to_ranks
 from setup.setup import RESULTS_PATH
 from setup.utils import create_directory, save_json
 
@@ -105,9 +106,6 @@ def generate_instance(num_instances, agents, min_val):
     arm_rewards_list = []
     arm_preferences_list = []
 
-    avg_avg_ranking = []
-    avg_min_ranking = []
-    avg_max_ranking = []
     seeds = []
     for i in range(num_instances):
         # generate instance
@@ -130,20 +128,14 @@ def generate_instance(num_instances, agents, min_val):
         arm_rewards_list += [arm_rewards]
         arm_preferences_list += [arm_preferences]
 
-        # here we just print some statics about the instances
-        gs_match_4 = gale_shapley_algo(player_ranking=player_preferences_4,
-                                       arms_rankings=arm_preferences,
-                                       num_players=agents,
-                                       num_arms=agents)
-
-        ranks4 = []
-        for p in range(agents):
-            player_stable_match = gs_match_4[p]
-            rank_sm_p4 = player_preferences_4[p].index(player_stable_match)
-            ranks4 += [rank_sm_p4]
-        avg_avg_ranking += [np.mean(ranks4)]
-        avg_min_ranking += [np.min(ranks4)]
-        avg_max_ranking += [np.max(ranks4)]
+    # here we just print some statics about the instances, all instances are matched in one batch
+    gs_match_4, _ = batched_gale_shapley(proposer_preferences=player_preferences_list_4,
+                                         receiver_ranks=preferences_to_ranks(arm_preferences_list))
+    player_ranks_4 = preferences_to_ranks(player_preferences_list_4)
+    ranks4 = np.take_along_axis(player_ranks_4, gs_match_4[:, :, None], axis=2)[:, :, 0]
+    avg_avg_ranking = ranks4.mean(axis=1)
+    avg_min_ranking = ranks4.min(axis=1)
+    avg_max_ranking = ranks4.max(axis=1)
     print(f"player {agents} avg : {np.mean(avg_avg_ranking)}")
     print(f"player {agents} max : {np.max(avg_max_ranking)}")
     print(f"player {agents} min : {np.min(avg_min_ranking)}")
@@ -1,10 +1,48 @@
 """
 This code runs the simulations both instance and every algorithm and number of agents
+
+The grid num_players x instance x algorithm is expanded into tasks that are run on a process pool, the most
+expensive tasks first. The grid can be given as a YAML file: python run_all.py grid.yaml
+The results of the sweep are loaded with matching.cetralised_platforms.pac.results_store.load_results(workspace)
 """
+import multiprocessing
+import os
+import sys
+import time
+
+import yaml
+
 from matching.cetralised_platforms.pac.get_algo import pac_algorithms
 from matching.cetralised_platforms.pac.run_instances import run_instances
 from setup.setup import RESULTS_PATH
-from setup.utils import create_directory, load_json
+from setup.utils import create_directory, load_json, save_json
+
+# default grid, the keys of a YAML grid spec
+DEFAULT_GRID = {
+    "workspace": RESULTS_PATH + "/paper/simulations",  # has to be the one we used when we generate the instance
+    "run": "run_1",
+    "algorithms": ["NaiveUniformlySampling", "Elimination", "ImprovedElimination", "AdapElimination"],
+    "num_players": [3, 5, 10, 15, 20],
+    "instances": [1, 2],
+    "delta": 0.1,  # δ
+    "variance": 1,
+    "workers": os.cpu_count(),
+    # snapshots of the runs, a sweep run again skips the completed runs and resumes the others
+    "checkpoint_rounds": None,
+    "checkpoint_seconds": 600,
+}
+
+# relative cost of the algorithms on the same instance, the cost of a task without past runtime is weight * N^2.
+# Seconds per run relative to Elimination, measured on one run of instances 1 and 2 at N = 20 (min_val 0.05):
+# NaiveUniformlySampling 75 / 82s, Elimination 54 / 64s, ImprovedElimination 58 / 53s, AdapElimination 39 / 32s.
+# ETC was not measured and gets the weight of Elimination. The runtimes of a sweep replace these estimates.
+ALGORITHM_COST = {
+    "ETC": 1.0,
+    "NaiveUniformlySampling": 1.33,
+    "Elimination": 1.0,
+    "ImprovedElimination": 0.94,
+    "AdapElimination": 0.6,
+}
 
 
 def run_algorithms(delta,
@@ -16,7 +54,11 @@ def run_algorithms(delta,
                    mean_player_rewards,
                    mean_arm_rewards,
                    seeds,
-                   variance=1):
+                   variance=1,
+                   workers=1,
+                   checkpoint_rounds=None,
+                   checkpoint_seconds=None,
+                   instance=0):
     """"
     runs all algorithm for on a list of instances
     """
@@ -36,35 +78,112 @@ def run_algorithms(delta,
                                 num_players=num_players,
                                 variance=variance,
                                 seeds=seeds,
-                                save_path=save_dir_delta)
+                                save_path=save_dir_delta,
+                                workers=workers,
+                                checkpoint_rounds=checkpoint_rounds,
+                                checkpoint_seconds=checkpoint_seconds,
+                                results_key={"algorithm": algorithm_name,
+                                             "num_players": num_players,
+                                             "instance": instance,
+                                             "delta": delta})
+
+
+def load_grid(spec_path=None):
+    """ the default grid updated with the keys of a YAML spec """
+    grid = dict(DEFAULT_GRID)
+    if spec_path is not None:
+        with open(spec_path, "r") as file:
+            grid.update(yaml.safe_load(file) or {})
+    unknown = set(grid) - set(DEFAULT_GRID)
+    if unknown:
+        raise ValueError(f"unknown grid keys {sorted(unknown)}")
+    return grid
+
+
+def task_name(task):
+    return f"{task['algorithm']}/instance_{task['instance']}/players_{task['num_players']}_delta_{task['delta']}"
+
+
+def expand_grid(grid):
+    """ one task per (num_players, instance, algorithm) """
+    return [{"algorithm": algorithm,
+             "num_players": num_players,
+             "instance": instance,
+             "delta": grid["delta"],
+             "variance": grid["variance"],
+             "workspace": grid["workspace"],
+             "run": grid["run"],
+             "checkpoint_rounds": grid["checkpoint_rounds"],
+             "checkpoint_seconds": grid["checkpoint_seconds"]}
+            for num_players in grid["num_players"]
+            for instance in grid["instances"]
+            for algorithm in grid["algorithms"]]
+
+
+def model_cost(task):
+    return ALGORITHM_COST.get(task["algorithm"], 1.0) * task["num_players"] ** 2
+
+
+def expected_cost(task, runtimes, scale=1.0):
+    """ the last runtime of the task if it ran before, otherwise its model cost in seconds """
+    if task_name(task) in runtimes:
+        return runtimes[task_name(task)]
+    return scale * model_cost(task)
+
+
+def schedule(tasks, runtimes):
+    """
+    largest expected cost first, so the long tasks do not run alone at the end of the sweep. The model costs are
+    converted to seconds with the median ratio of the past runtimes to the model costs
+    """
+    ratios = sorted(runtimes[task_name(task)] / model_cost(task) for task in tasks if task_name(task) in runtimes)
+    scale = ratios[len(ratios) // 2] if ratios else 1.0
+    return sorted(tasks, key=lambda task: expected_cost(task, runtimes, scale), reverse=True)
+
+
+def run_task(task):
+    """ run one algorithm on the runs of one instance, returns the task and its runtime """
+    start_time = time.time()
+    num_players, instance = task["num_players"], task["instance"]
+    load_data_path = task["workspace"] + f"/data/instance_{instance}_player_{num_players}"
+    print("**************************")
+    print(f"** Run {task['algorithm']} instance {instance} for delta {task['delta']} num_players {num_players} **")
+    print("**************************")
+    run_algorithms(delta=task["delta"],
+                   algos=[task["algorithm"]],
+                   num_players=num_players,
+                   save_path=task["workspace"] + f"/instance_{instance}/{task['run']}/",
+                   players_rankings=load_json(load_data_path + "/players_rankings.json"),
+                   arm_rankings=load_json(load_data_path + "/arm_rankings.json"),
+                   mean_player_rewards=load_json(load_data_path + "/mean_player_rewards.json"),
+                   mean_arm_rewards=load_json(load_data_path + "/mean_arm_rewards.json"),
+                   seeds=load_json(load_data_path + "/seeds.json"),
+                   variance=task["variance"],
+                   checkpoint_rounds=task["checkpoint_rounds"],
+                   checkpoint_seconds=task["checkpoint_seconds"],
+                   instance=instance)
+    return task, time.time() - start_time
+
+
+def run_grid(grid):
+    """
+    run every task of the grid on a pool of grid["workers"] processes, the runtimes are saved in the workspace
+    and used as the cost of the tasks in the next sweeps
+    """
+    runtimes_path = grid["workspace"] + "/runtimes.json"
+    runtimes = load_json(runtimes_path) if os.path.isfile(runtimes_path) else {}
+    tasks = schedule(expand_grid(grid), runtimes)
+    workers = max(1, min(grid["workers"] or 1, len(tasks)))
+    # one task at a time per worker, a free worker takes the next most expensive task
+    with multiprocessing.Pool(processes=workers) as pool:
+        for task, runtime in pool.imap_unordered(run_task, tasks, chunksize=1):
+            print(f"done {task_name(task)} in {runtime:.1f}s")
+            runtimes[task_name(task)] = runtime
+            save_json(runtimes, runtimes_path)
+    return runtimes
 
 
 if __name__ == "__main__":
-    # workspace has to be the same with one we used when we generate the instance
-    workspace_dir = RESULTS_PATH + "/paper/simulations"
-    create_directory(workspace_dir)
-
-    algos = ["NaiveUniformlySampling", "Elimination", "ImprovedElimination", "AdapElimination"]
-    delta = 0.1  # δ
-    for num_p in [3, 5, 10, 15, 20]:
-        for instance in [1, 2]:
-            load_data_path = workspace_dir + f"/data/instance_{instance}_player_{num_p}"
-
-            players_rankings = load_json(load_data_path + "/players_rankings.json")
-            arm_rankings = load_json(load_data_path + "/arm_rankings.json")
-            mean_player_rewards = load_json(load_data_path + "/mean_player_rewards.json")
-            mean_arm_rewards = load_json(load_data_path + "/mean_arm_rewards.json")
-            seeds = load_json(load_data_path + "/seeds.json")
-            print("**************************")
-            print(f"** Run instance {instance} for delta {delta} num_players {num_p} **")
-            print("**************************")
-            run_algorithms(delta=delta,
-                           algos=algos,
-                           num_players=num_p,
-                           save_path=workspace_dir + f"/instance_{instance}/run_1/",
-                           players_rankings=players_rankings,
-                           arm_rankings=arm_rankings,
-                           mean_player_rewards=mean_player_rewards,
-                           mean_arm_rewards=mean_arm_rewards,
-                           seeds=seeds,
-                           variance=1)
+    grid = load_grid(sys.argv[1] if len(sys.argv) > 1 else None)
+    create_directory(grid["workspace"])
+    run_grid(grid)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+
+from experiments.pac.run_all import DEFAULT_GRID, load_grid, expand_grid, model_cost, expected_cost, schedule, \
+    task_name
+
+GRID_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grid.yaml")
+
+
+def test_load_grid():
+    """
+    the keys of a YAML spec override the defaults, unknown keys are rejected
+    """
+    assert load_grid() == DEFAULT_GRID
+    with tempfile.TemporaryDirectory() as directory:
+        spec_path = directory + "/grid.yaml"
+        with open(spec_path, "w") as file:
+            file.write("num_players: [4]\nworkers: 2\n")
+        grid = load_grid(spec_path)
+        assert grid["num_players"] == [4] and grid["workers"] == 2
+        assert {name: value for name, value in grid.items() if name not in ("num_players", "workers")} == \
+            {name: value for name, value in DEFAULT_GRID.items() if name not in ("num_players", "workers")}
+
+        with open(spec_path, "w") as file:
+            file.write("num_player: [4]\n")
+        try:
+            load_grid(spec_path)
+            assert False, "num_player is not a key of the grid"
+        except ValueError:
+            pass
+    print("End")
+
+
+def test_expand_grid():
+    """
+    grid.yaml expands to one task per (num_players, instance, algorithm)
+    """
+    grid = load_grid(GRID_PATH)
+    tasks = expand_grid(grid)
+    assert len(tasks) == 40
+    assert {(task["algorithm"], task["num_players"], task["instance"]) for task in tasks} == \
+        {(algorithm, num_players, instance) for algorithm in grid["algorithms"]
+         for num_players in grid["num_players"] for instance in grid["instances"]}
+    assert all(task["delta"] == grid["delta"] and task["run"] == grid["run"] for task in tasks)
+    print("End")
+
+
+def test_schedule():
+    """
+    a recorded runtime is the cost of its task, the model costs of the other tasks are scaled by the median ratio
+    of the runtimes to the model costs, and the tasks are run largest cost first
+    """
+    tasks = expand_grid(load_grid(GRID_PATH))
+    # without runtimes the model costs give the order
+    ordered = schedule(tasks, {})
+    costs = [model_cost(task) for task in ordered]
+    assert costs == sorted(costs, reverse=True)
+
+    # runtimes of three tasks with ratios 2, 3 and 10 to their model costs
+    recorded = [task for task in tasks if task["num_players"] == 3 and task["instance"] == 1][:3]
+    runtimes = {task_name(task): ratio * model_cost(task) for task, ratio in zip(recorded, [2, 3, 10])}
+    # a runtime takes precedence over the model cost
+    assert expected_cost(recorded[2], runtimes, scale=1.0) == 10 * model_cost(recorded[2])
+    ordered = schedule(tasks, runtimes)
+    costs = [runtimes[task_name(task)] if task_name(task) in runtimes else 3 * model_cost(task) for task in ordered]
+    assert costs == sorted(costs, reverse=True)
+    assert sorted(map(task_name, ordered)) == sorted(map(task_name, tasks))
+
+    # a small task that ran for long goes first
+    runtimes = {task_name(task): model_cost(task) for task in tasks}
+    slow = min(tasks, key=model_cost)
+    runtimes[task_name(slow)] = 10 ** 6
+    assert task_name(schedule(tasks, runtimes)[0]) == task_name(slow)
+    print("End")
+
+
+if __name__ == "__main__":
+    test_load_grid()
+    test_expand_grid()
+    test_schedule()
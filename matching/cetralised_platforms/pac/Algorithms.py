@@ -1,7 +1,12 @@
+import time
+
 import numpy as np
-from matching.cetralised_platforms.pac.cetralised_platform import CentralisedPlatform
+from matching.cetralised_platforms.pac.cetralised_platform import CentralisedPlatform, prefixed, unprefixed
+from matching.cetralised_platforms.pac.elimination_kernel import overlap_counts
+from matching.cetralised_platforms.pac.pac_tracker import AnytimePacTracker
+from matching.cetralised_platforms.pac.time_series import TimeSeriesRecorder
 
-from matching.matching_algo.coloring.minimum_edge_coloring import get_matchings_edge_coloring
+from matching.matching_algo.coloring.minimum_edge_coloring import IncrementalEdgeColoring
 from setup.utils import save_json
 
 
@@ -15,6 +20,8 @@ class Base_Elimination(CentralisedPlatform):
                  variance,
                  seed,
                  random_state=None,
+                 sample_store="off",
+                 sample_directory=None,
                  **kwargs):
         CentralisedPlatform.__init__(self,
                                      delta=delta,
@@ -24,10 +31,16 @@ class Base_Elimination(CentralisedPlatform):
                                      mean_rewards=mean_rewards_players,
                                      variance=variance,
                                      seed=seed,
-                                     random_state=random_state)
+                                     random_state=random_state,
+                                     sample_store=sample_store,
+                                     sample_directory=sample_directory)
         self.confidence_intervals = np.ones((self.num_players, self.num_players, 2)) * np.inf
         self.confidence_intervals[:, :, 0] = - np.inf
         self.alpha = np.zeros((self.num_players, self.num_players, 2))
+        # sum of the rewards of every pair, integer for Bernoulli rewards, the means are derived from the sums
+        reward_dtype = np.int64 if self.reward_oracle.distribution == "bernoulli" else float
+        self.reward_sums = np.zeros((self.num_players, self.num_players), dtype=reward_dtype)
+        self.started = False
 
     @staticmethod
     def is_overalping(interval_1, intraval_2):
@@ -39,29 +52,10 @@ class Base_Elimination(CentralisedPlatform):
             return True
 
     def eliminate_agents(self, available_arms_matrix, confidence_intervals):
-        available_arms = []
-        for player in range(self.num_players):
-            tmp_arms = []
-            for arm in range(self.num_players):
-                if available_arms_matrix[player, arm] == 0:
-                    tmp_arms += [arm]
-            available_arms += [tmp_arms]
-
-        for player in range(self.num_players):
-            for arm in available_arms[player]:
-                eliminate = True
-                for other_arms in set(available_arms[player]) - {arm}:
-                    if self.is_overalping(confidence_intervals[player, arm, :],
-                                          confidence_intervals[player, other_arms, :]):
-                        eliminate = False
-                        break
-
-                if eliminate:
-                    # print("ELIMINATED at round!, :", self.round)
-                    # print(player, arm)
-                    # print(self.confidence_intervals)
-                    available_arms_matrix[player, arm] = 1
-
+        # an available arm is eliminated when its interval overlaps none of the other available arms of the player
+        available = available_arms_matrix == 0
+        overlaps = overlap_counts(confidence_intervals[:, :, 0], confidence_intervals[:, :, 1], available)
+        available_arms_matrix[available & (overlaps == 0)] = 1
         return available_arms_matrix
 
     def update_confidence_interval(self, t):
@@ -69,125 +63,167 @@ class Base_Elimination(CentralisedPlatform):
         self.confidence_intervals[:, :, 0] = self.avg_players_reward - self.alpha
         self.confidence_intervals[:, :, 1] = self.avg_players_reward + self.alpha
 
+    def estimated_means(self):
+        """ empirical means of the pairs from the reward sums and counts, 0 for the pairs never played """
+        return np.divide(self.reward_sums, self.num_plays, out=np.zeros(self.num_plays.shape),
+                         where=self.num_plays > 0)
+
     def update_reward(self, reward, num_plays, old_rewards):
         new_rewards = ((old_rewards * num_plays) + reward) / (num_plays + 1)
         return new_rewards
 
     def get_matches(self, available_arms):
-        availability_matrix = np.copy(available_arms)
-        matchings = get_matchings_edge_coloring(num_players=self.num_players,
-                                                adjacency_matrix=1 - availability_matrix)
+        # the colouring of the previous round is reused, or repaired after eliminations
+        matchings = self.edge_coloring.update(available_arms == 0)
         return matchings, len(matchings)
 
     def stopping_rule(self, **kwargs):
         raise NotImplementedError("define stopping_rule")
 
-    def run(self):
-        # exploration steps
-        available_arms = np.zeros((self.num_players, self.num_players))  # 0 for available, 1 for eliminated
-
-        flag = True
+    def start(self):
+        """ state at the beginning of a run """
+        self.available_arms = np.zeros((self.num_players, self.num_players))  # 0 for available, 1 for eliminated
+        self.flag = True
         self.round = 0
+        self.edge_coloring = IncrementalEdgeColoring(num_players=self.num_players)
         self.matching_rounds = 0
         self.num_samples = 0
         self.optimal_stable = []
-        self.optimal_stable2 = []
-        self.pref_true = []
-        self.pref_up_to_stable_match = []
-        self.optimal_match_round_id = []
-        self.optimal_match_matching_id = []
-        self.optimal_match_sample_id = []
-        fist_matching_elim = None
-        while flag:
+        # anytime metrics, one row per sampled matching
+        self.anytime_metrics = TimeSeriesRecorder({"pref_true": bool,
+                                                   "pref_up_to_stable_match": np.int64,
+                                                   "optimal_stable": bool,
+                                                   "round_id": np.int64,
+                                                   "matching_id": np.int64,
+                                                   "sample_id": np.int64})
+        self.pac_tracker = AnytimePacTracker(empirical_preferences=self.empirical_preferences,
+                                             player_preferences=self.player_preferences,
+                                             optimal_match=self.optimal_match,
+                                             matcher=self.empirical_match)
+        self.fist_matching_elim = None
+        self.started = True
+
+    def get_state(self):
+        state = CentralisedPlatform.get_state(self)
+        state.update({"available_arms": self.available_arms,
+                      "flag": self.flag,
+                      "round": self.round,
+                      "matching_rounds": self.matching_rounds,
+                      "num_samples": self.num_samples,
+                      "fist_matching_elim": -1 if self.fist_matching_elim is None else self.fist_matching_elim,
+                      "reward_sums": self.reward_sums,
+                      "confidence_intervals": self.confidence_intervals,
+                      "alpha": self.alpha})
+        state.update(prefixed("edge_coloring", self.edge_coloring.get_state()))
+        state.update(prefixed("anytime_metrics", self.anytime_metrics.get_state()))
+        return state
+
+    def set_state(self, state):
+        CentralisedPlatform.set_state(self, state)
+        # the anytime metrics of the empirical orders are computed again from the restored orders
+        self.start()
+        self.available_arms = np.array(state["available_arms"])
+        self.flag = bool(state["flag"])
+        self.round = int(state["round"])
+        self.matching_rounds = int(state["matching_rounds"])
+        self.num_samples = int(state["num_samples"])
+        self.fist_matching_elim = None if state["fist_matching_elim"] < 0 else int(state["fist_matching_elim"])
+        self.reward_sums = np.array(state["reward_sums"])
+        self.confidence_intervals = np.array(state["confidence_intervals"])
+        self.alpha = np.array(state["alpha"])
+        self.edge_coloring.set_state(unprefixed("edge_coloring", state))
+        self.anytime_metrics.set_state(unprefixed("anytime_metrics", state))
+
+    def checkpoint_due(self, last_round, last_time):
+        if self.checkpoint_path is None:
+            return False
+        return (self.checkpoint_rounds is not None and self.round - last_round >= self.checkpoint_rounds) or \
+            (self.checkpoint_seconds is not None and time.time() - last_time >= self.checkpoint_seconds)
+
+    def run(self):
+        # exploration steps, a run restored from a snapshot continues from its state
+        if not self.started:
+            self.start()
+        last_checkpoint_round, last_checkpoint_time = self.round, time.time()
+        while self.flag:
             # generate matchings
-            matches, tmp_matching_rounds = self.get_matches(np.copy(available_arms))
+            matches, tmp_matching_rounds = self.get_matches(self.available_arms)
             # keep track of the first round we sample less matching - eliminate a matching
-            if (len(matches) < self.num_players) and fist_matching_elim is None:
-                fist_matching_elim = self.round + 1
+            if (len(matches) < self.num_players) and self.fist_matching_elim is None:
+                self.fist_matching_elim = self.round + 1
 
             self.round += 1
-            for tmp_match in matches:
+            # the matchings of a round cover every pair at most once, so the whole round is drawn in one call and
+            # the sums and counts of its pairs are updated together, arm -1 for the players left out of a matching
+            sampled = matches[:, :, 1] >= 0
+            round_players, round_arms = matches[:, :, 0][sampled], matches[:, :, 1][sampled]
+            round_rewards = self.sample_rewards(players=round_players, arms=round_arms)
+            np.add.at(self.reward_sums, (round_players, round_arms), round_rewards)
+            np.add.at(self.num_plays, (round_players, round_arms), 1)
+            round_means = self.reward_sums[round_players, round_arms] / self.num_plays[round_players, round_arms]
+            round_offsets = np.r_[0, np.cumsum(sampled.sum(axis=1))].tolist()
+            for start, end in zip(round_offsets[:-1], round_offsets[1:]):
                 self.matching_rounds += 1
-                # sample rewards and update empirical estimates
-                for (player, arm) in tmp_match:
-                    tuple_match = (player, arm)
-                    tmp_player_reward = self.sample_reward(player=player,
-                                                           arm=arm,
-                                                           mean_rewards=self.mean_rewards)
-                    # update
-                    self.avg_players_reward[tuple_match] = self.update_reward(reward=tmp_player_reward,
-                                                                              num_plays=self.num_plays[tuple_match],
-                                                                              old_rewards=self.avg_players_reward[
-                                                                                  tuple_match])
-                    self.num_samples += 1
-                    self.num_plays[tuple_match] += 1
-                self.calc_pac_metrics()  # this is for the anytime performance of the algorithms
+                self.num_samples += end - start
+                # update empirical estimates
+                changed_players = self.empirical_preferences.update(players=round_players[start:end],
+                                                                    arms=round_arms[start:end],
+                                                                    means=round_means[start:end])
+                # this is for the anytime performance of the algorithms
+                self.calc_pac_metrics(players=changed_players)
+            self.avg_players_reward = self.estimated_means()
 
             stable_flag = 0
-            self.stability_over_time = np.append(self.stability_over_time, stable_flag)
-            player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-            pref_flag = player_preferences == self.player_preferences
-            self.pref_over_time = np.append(self.pref_over_time, pref_flag)
+            self.stability_over_time.append(stable_flag)
+            pref_flag, _, _ = self.pac_tracker.metrics()
+            self.pref_over_time.append(pref_flag)
             # 2. update confidence intervals
             self.update_confidence_interval(t=self.round)
 
             # 3. eliminate pairs
-            available_arms = self.eliminate_agents(available_arms_matrix=available_arms,
-                                                   confidence_intervals=self.confidence_intervals)
+            self.available_arms = self.eliminate_agents(available_arms_matrix=self.available_arms,
+                                                        confidence_intervals=self.confidence_intervals)
             # 4. Stopping rule
-            flag = self.stopping_rule(available_arms=available_arms)
+            self.flag = self.stopping_rule(available_arms=self.available_arms)
+            if self.flag and self.checkpoint_due(last_checkpoint_round, last_checkpoint_time):
+                self.save_snapshot(self.checkpoint_path)
+                last_checkpoint_round, last_checkpoint_time = self.round, time.time()
 
         # get final metrics
-        player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-        final_match = self.match(player_preferences, self.arm_preferences)
+        final_match = self.empirical_match(self.empirical_preferences.order)
         stable_flag = self.is_stable(final_match.tolist())
-        pref_flag = player_preferences == self.player_preferences
+        pref_flag, _, _ = self.pac_tracker.metrics()
 
         self.optimal_stable = np.all(final_match == self.optimal_match)
         self.sample_complexity = self.matching_rounds + 1
         self.stability = stable_flag
-        self.pref_over_time = np.append(self.pref_over_time, pref_flag)
+        self.pref_over_time.append(pref_flag)
         try:
-            self.max_pref = np.where(self.pref_over_time == 0)[0].max()
+            self.max_pref = np.where(self.pref_over_time.to_numpy() == 0)[0].max()
         except:
             self.max_pref = 0
         return
 
-    def calc_pac_metrics(self):
-        # 5. check stability adn preferences
-        # A. check if preferences are correct
-        tmp_player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-        tmp_gs = self.match(tmp_player_preferences, self.arm_preferences)
-
-        # B.  check if preferences up to the stable match are are correct
-        self.pref_true += [tmp_player_preferences == self.player_preferences]
-        res = []
-        for p in range(self.num_players):
-            # 1. get preference up to stable match
-            player_stable_match = self.optimal_match[p]
-            index_true_pref = self.player_preferences[p].index(player_stable_match)
-            tmp_true_pref = self.player_preferences[p][:index_true_pref + 1]
-
-            index_pref = tmp_player_preferences[p].index(player_stable_match)
-            tmp_est_pref = self.player_preferences[p][:index_pref + 1]
-            # 2. check if is correct
-            res += [tmp_true_pref == tmp_est_pref]
-        correct_preference_up_stable_match = np.all(res)
-        self.pref_up_to_stable_match += [int(correct_preference_up_stable_match) * 1]
-
-        # C. match is optimal stable
-        self.optimal_stable2 += [tmp_gs.tolist() == self.optimal_match.tolist()]
-        self.optimal_match_round_id += [self.round]
-        self.optimal_match_matching_id += [self.matching_rounds]
-        self.optimal_match_sample_id += [self.num_samples]
+    def calc_pac_metrics(self, players=None):
+        """
+        A. preferences are correct, B. preferences up to the stable match are correct, C. the match is optimal
+        stable. Only the players whose preference order changed (all when None) are checked again.
+        """
+        pref_true, pref_up_to_stable_match, optimal_stable = self.pac_tracker.update(players=players)
+        self.anytime_metrics.append(pref_true,
+                                    int(pref_up_to_stable_match),
+                                    optimal_stable,
+                                    self.round,
+                                    self.matching_rounds,
+                                    self.num_samples)
 
     def save_results(self, save_path):
-        res = {"pref_over_time": self.pref_true,
-               "pref_up_to_stable_match_over_time": self.pref_up_to_stable_match,
-               "stability_over_time": self.optimal_stable2,
-               "round_index": self.optimal_match_round_id,
-               "matching_index": self.optimal_match_matching_id,
-               "sample_index": self.optimal_match_sample_id}
+        res = {"pref_over_time": self.anytime_metrics.to_list("pref_true"),
+               "pref_up_to_stable_match_over_time": self.anytime_metrics.to_list("pref_up_to_stable_match"),
+               "stability_over_time": self.anytime_metrics.to_list("optimal_stable"),
+               "round_index": self.anytime_metrics.to_list("round_id"),
+               "matching_index": self.anytime_metrics.to_list("matching_id"),
+               "sample_index": self.anytime_metrics.to_list("sample_id")}
         save_json(res, save_path + '/check_results.json')
 
 
@@ -220,11 +256,9 @@ class NaiveUniformlySampling_pac(Base_Elimination):
         """
         Round-robin
         """
-        matchings = []
-        for h in range(self.num_players):
-            t = self.round + h
-            matching = [(player, (t + player) % self.num_players) for player in range(self.num_players)]
-            matchings += [np.array(matching)]
+        players = np.arange(self.num_players)
+        arms = (self.round + players[:, None] + players[None, :]) % self.num_players  # arms[h, player]
+        matchings = np.stack([np.broadcast_to(players, arms.shape), arms], axis=-1)
         return matchings, len(matchings)
 
     def stopping_rule(self, available_arms, **kwargs):
@@ -283,20 +317,13 @@ class ImproveElimination_Algo_pac(Base_Elimination):
 
     def stopping_rule(self, available_arms, **kwargs):
         # gale shapley algo
-        player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-        gs_match = self.match(player_preferences, self.arm_preferences)
-
-        flag = False  # flag = False -> we stop
-        for player in range(self.num_players):
-            ms_p = gs_match[player]
-            index_pref = player_preferences[player].index(ms_p)
-            arms_to_check = player_preferences[player][:index_pref + 1]
-            for arm in arms_to_check:
-                if available_arms[player, arm] == 0:  # arms is not eliminated so we have to explore more
-                    flag = True  # flag= True -> we continue
-                    break
-            if flag:
-                break
+        preferences = self.empirical_preferences
+        gs_match = self.empirical_match(preferences.order)
+
+        # flag = False -> we stop, flag= True -> we continue as some arm up to the match is not eliminated
+        players = np.arange(self.num_players)
+        arms_to_check = preferences.ranks <= preferences.ranks[players, gs_match][:, None]
+        flag = bool(np.any(arms_to_check & (available_arms == 0)))
 
         if not flag:
             print("stop", available_arms)
@@ -332,21 +359,16 @@ class AdaptiveImproveElimination_Algo_pac(Base_Elimination):
     def eliminate_agents(self, available_arms_matrix, confidence_intervals):
         # available_arms_matrix not used
         # 1. get gale shapley match
-        player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-        gs_match = self.match(player_preferences, self.arm_preferences)
-
-        # 2. get arms to explore
+        preferences = self.empirical_preferences
+        gs_match = self.empirical_match(preferences.order)
+
+        # 2. get arms to explore: the arms up to the match and every arm overlapping one of them
+        arms_to_check = preferences.ranks <= preferences.ranks[np.arange(self.num_players), gs_match][:, None]
+        lower, upper = confidence_intervals[:, :, 0], confidence_intervals[:, :, 1]
+        overlapping = overlap_counts(lower, upper, np.ones_like(arms_to_check)) > 0
+        overlapping_checked = overlap_counts(lower, upper, arms_to_check) > 0
         active_arms = np.ones((self.num_players, self.num_players))  # one indicate eliminated arms
-        for player in range(self.num_players):
-            ms_p = gs_match[player]
-            index_pref = player_preferences[player].index(ms_p)
-            arms_to_check = player_preferences[player][:index_pref + 1]
-            for arm in arms_to_check:
-                for other_arm in set(range(self.num_players)) - {arm}:
-                    if self.is_overalping(confidence_intervals[player, arm, :],
-                                          confidence_intervals[player, other_arm, :]):
-                        active_arms[player, arm] = 0
-                        active_arms[player, other_arm] = 0
+        active_arms[(arms_to_check & overlapping) | overlapping_checked] = 0
 
         return active_arms
 
@@ -2,7 +2,7 @@
 Base class for the algorithms
 """
 import numpy as np
-from matching.matching_algo.is_stable import is_stable
+from matching.matching_algo.is_stable import batch_is_stable
 class BasePlatform(object):
     """
     Base class for cetralised platforms for gaussian rewards
@@ -10,14 +10,13 @@ class BasePlatform(object):
 
     @staticmethod
     def preferences_from_rewards(rewards):
-        return np.argsort(-rewards).tolist()  # - for arg sort in descending order
+        return np.argsort(-rewards, kind="stable").tolist()  # - for arg sort in descending order, ties by arm
 
     def is_stable(self, match):
-        stable = is_stable(match,
-                           self.arm_preferences,
-                           self.player_preferences,
-                           self.num_players)
-        return stable
+        stable = batch_is_stable([match],
+                                 player_ranks=self.player_ranks,
+                                 arm_ranks=self.arm_ranks)
+        return bool(stable[0])
 
     def match(self, **kwargs):
         """
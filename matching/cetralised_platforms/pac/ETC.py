@@ -3,6 +3,7 @@ import math
 import numpy as np
 
 from matching.cetralised_platforms.pac.cetralised_platform import CentralisedPlatform
+from matching.matching_algo.is_stable import batch_is_stable
 
 
 class ETC_pac(CentralisedPlatform):
@@ -37,15 +38,18 @@ class ETC_pac(CentralisedPlatform):
         print(f"Δ: {Delta_min}")
 
     def run(self):
-        # exploration steps
+        # exploration steps, the round-robin cycles through num_players matchings so we check their stability once
+        players = np.arange(self.num_players)
+        round_robin = (players[:, None] + players[None, :]) % self.num_players
+        round_robin_stable = batch_is_stable(round_robin, player_ranks=self.player_ranks, arm_ranks=self.arm_ranks)
         for t in range(self.sample_complexity):
-            tmp_match = [(t + player) % self.num_players for player in range(self.num_players)]
+            tmp_match = round_robin[t % self.num_players].tolist()
             # update metrics
-            stable_flag = self.is_stable(tmp_match)
-            self.stability_over_time = np.append(self.stability_over_time, stable_flag)
+            stable_flag = round_robin_stable[t % self.num_players]
+            self.stability_over_time.append(stable_flag)
             player_preferences = self.preferences_from_rewards(self.avg_players_reward)
             pref_flag = player_preferences == self.player_preferences
-            self.pref_over_time = np.append(self.pref_over_time, pref_flag)
+            self.pref_over_time.append(pref_flag)
 
             optimal_regret = np.zeros(self.num_players)
             pessimal_regret = np.zeros(self.num_players)
@@ -64,18 +68,18 @@ class ETC_pac(CentralisedPlatform):
                     tuple_match]
                 pessimal_regret[player] = self.mean_rewards[player, self.pessimal_match[player]] - self.mean_rewards[
                     tuple_match]
-            self.player_optimal_regret += [optimal_regret]
-            self.player_pessimal_regret += [pessimal_regret]
+            self.player_optimal_regret.append(optimal_regret)
+            self.player_pessimal_regret.append(pessimal_regret)
 
         # exploitation steps
         player_preferences = self.preferences_from_rewards(self.avg_players_reward)
-        final_match = self.match(player_preferences, self.arm_preferences)
+        final_match = self.empirical_match(player_preferences)
         stable_flag = self.is_stable(final_match.tolist())
         pref_flag = player_preferences == self.player_preferences
 
         self.optimal_stable = np.all(final_match == self.optimal_match)
         self.sample_complexity = self.sample_complexity
         self.stability = stable_flag
-        self.pref_over_time = np.append(self.pref_over_time, pref_flag)
-        self.max_pref = np.where(self.pref_over_time == 0)[0].max()
+        self.pref_over_time.append(pref_flag)
+        self.max_pref = np.where(self.pref_over_time.to_numpy() == 0)[0].max()
         return
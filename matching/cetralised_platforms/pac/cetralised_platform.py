@@ -1,17 +1,43 @@
 """
 Base class for centralised algorithms
 """
+import hashlib
+import os
+from collections import OrderedDict
+
 import numpy as np
 
 from matching.cetralised_platforms.pac.BasePlatform import BasePlatform
-from matching.distributions.bernoulli import BernoulliDistribution
-from matching.utils import inv_matching
-from matching.matching_algo.gale_shapley import gale_shapley_algo
+from matching.cetralised_platforms.pac.empirical_preferences import EmpiricalPreferences
+from matching.cetralised_platforms.pac.sample_store import sample_stores
+from matching.cetralised_platforms.pac.time_series import TimeSeriesRecorder
+from matching.distributions.reward_oracle import RewardOracle
+from matching.utils import preferences_to_ranks
+from matching.matching_algo.gale_shapley import stable_match, batched_gale_shapley
+from matching.matching_algo.incremental_gale_shapley import IncrementalGaleShapley
+
+def prefixed(prefix, state):
+    """ the keys of a component state prefixed with the name of the component """
+    return {f"{prefix}.{name}": value for name, value in state.items()}
+
+
+def unprefixed(prefix, state):
+    """ the state of one component from a snapshot """
+    return {name[len(prefix) + 1:]: value for name, value in state.items() if name.startswith(prefix + ".")}
+
 
 class CentralisedPlatform(BasePlatform):
     """
     Base class for centralised platforms for gaussian rewards
     """
+    match_cache_size = 1024  # number of empirical stable matchings kept in the LRU cache
+    # snapshots of the run every checkpoint_rounds rounds or checkpoint_seconds seconds, see set_checkpoint
+    checkpoint_path = None
+    checkpoint_rounds = None
+    checkpoint_seconds = None
+    recorders = ("player_pessimal_regret", "player_optimal_regret", "stability_over_time", "pref_over_time")
+    reward_buffer_size = 4096  # rewards pre-drawn per pair, None to draw them on demand
+    reward_buffer_max_pairs = 4096  # larger instances draw their rewards in vectorized batches only
 
     def __init__(self,
                  delta,
@@ -21,31 +47,49 @@ class CentralisedPlatform(BasePlatform):
                  mean_rewards,
                  variance,
                  seed,
-                 random_state=None):
-        self.reward_distributions = []
+                 random_state=None,
+                 sample_store="off",
+                 sample_directory=None):
+        self.reward_oracle = None
         self.seed = seed
         # global variables
         self.delta = delta
         self.num_players = num_players
         self.variance = variance
-        self.num_plays = np.zeros((self.num_players, self.num_players))
+        self.num_plays = np.zeros((self.num_players, self.num_players), dtype=np.int64)
         self.random_state = random_state
 
         #
         self.player_preferences = player_preferences
         self.arm_preferences = arm_preferences
+        self.player_ranks = preferences_to_ranks(player_preferences)
+        self.arm_ranks = preferences_to_ranks(arm_preferences)
         self.mean_rewards = np.array(mean_rewards)
         self.avg_players_reward = np.zeros((self.num_players, self.num_players))
+        # preference lists and ranks of avg_players_reward, updated with it
+        self.empirical_preferences = EmpiricalPreferences(self.avg_players_reward)
 
         # metrics
-        self.optimal_match = self.match(self.player_preferences, self.arm_preferences)  # optimal mode 0
-        self.pessimal_match = self.match(self.player_preferences, self.arm_preferences, mode=1)  # pessimal mode 1
+        # optimal (players propose) and pessimal (arms propose) matchings solved as one batch of two profiles
+        proposer_match, receiver_match = batched_gale_shapley(
+            proposer_preferences=[self.player_preferences, self.arm_preferences],
+            receiver_ranks=[self.arm_ranks, self.player_ranks])
+        self.optimal_match = proposer_match[0]  # optimal mode 0
+        self.pessimal_match = receiver_match[1]  # pessimal mode 1
+        # warm-started optimal matching of the empirical preferences
+        self.empirical_matcher = IncrementalGaleShapley(
+            player_preferences=self.empirical_preferences.order,
+            arm_ranks=self.arm_ranks)
+        self.matcher_follows_empirical = True  # the matcher was last updated with the empirical orders
+        self.match_cache = OrderedDict()
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
 
         # additional metrics
-        self.player_pessimal_regret = []
-        self.player_optimal_regret = []
-        self.stability_over_time = np.array([])
-        self.pref_over_time = np.array([])
+        self.player_pessimal_regret = TimeSeriesRecorder({"regret": (float, num_players)})
+        self.player_optimal_regret = TimeSeriesRecorder({"regret": (float, num_players)})
+        self.stability_over_time = TimeSeriesRecorder({"stable": bool})
+        self.pref_over_time = TimeSeriesRecorder({"correct_preferences": bool})
 
         self.optimal_stable = 0
         self.stability = 0
@@ -55,48 +99,120 @@ class CentralisedPlatform(BasePlatform):
                                        num_players=num_players,
                                        num_arms=num_players,
                                        mean_rewards=self.mean_rewards)  # this init the reward distribution
-        self.collected_samples = []
-        for p in range(self.num_players):
-            self.collected_samples += [[]]
-            for a in range(self.num_players):
-                self.collected_samples[p] += [[]]
+        # "off" keeps the sufficient statistics of the samples, "compact" and "full" the samples themselves,
+        # the "full" store writes them to sample_directory (a temporary directory if None)
+        self.samples = sample_stores[sample_store](num_players=num_players, num_arms=num_players, dtype=np.uint8,
+                                                   directory=sample_directory)
 
     def match(self, player_preferences, arm_preferences, mode=0, **kwargs):
         """
         performing Gale Shapley algorithm for matching
         """
-        if mode == 0:  # mode for optimal stable match otherwise pessimal matching
-            gale_shapley_match = gale_shapley_algo(player_ranking=player_preferences,
-                                                   arms_rankings=arm_preferences,
-                                                   num_players=self.num_players,
-                                                   num_arms=self.num_players)
-        else:  # this is the pessimal matching
-            gale_shapley_match = gale_shapley_algo(player_ranking=arm_preferences,
-                                                   arms_rankings=player_preferences,
-                                                   num_players=self.num_players,
-                                                   num_arms=self.num_players)
-            gale_shapley_match = inv_matching(gale_shapley_match).astype("int64")
+        # the true preferences are fixed, so we reuse their precomputed rank matrices
+        player_ranks = self.player_ranks if player_preferences is self.player_preferences else None
+        arm_ranks = self.arm_ranks if arm_preferences is self.arm_preferences else None
+        # mode 0 for optimal stable match otherwise pessimal matching (arms propose)
+        gale_shapley_match = stable_match(player_preferences=player_preferences,
+                                          arm_preferences=arm_preferences,
+                                          mode=mode,
+                                          player_ranks=player_ranks,
+                                          arm_ranks=arm_ranks)
+        return gale_shapley_match
 
+    def empirical_match(self, player_preferences):
+        """
+        player optimal stable matching of the given (empirical) player preferences and the true arm preferences.
+        Matchings are memoized in an LRU cache keyed by a hash of the player preference permutation matrix,
+        the returned arrays are read-only as they are shared between calls.
+        """
+        empirical = player_preferences is self.empirical_preferences.order
+        player_preferences = np.asarray(player_preferences, dtype=np.int64)
+        key = hashlib.blake2b(player_preferences.tobytes(), digest_size=16).digest()
+        gale_shapley_match = self.match_cache.get(key)
+        if gale_shapley_match is not None:
+            self.match_cache_hits += 1
+            self.match_cache.move_to_end(key)
+            return gale_shapley_match
+
+        self.match_cache_misses += 1
+        # the matcher only compares the rows of the players whose empirical order changed since its last update
+        changed_players = None
+        if empirical:
+            changed_players = self.empirical_preferences.pop_changed()
+            if not self.matcher_follows_empirical:
+                changed_players = None
+        self.matcher_follows_empirical = empirical
+        gale_shapley_match = self.empirical_matcher.update(player_preferences, changed_players=changed_players)
+        gale_shapley_match.setflags(write=False)
+        self.match_cache[key] = gale_shapley_match
+        if len(self.match_cache) > self.match_cache_size:
+            self.match_cache.popitem(last=False)
         return gale_shapley_match
 
     def set_rewards_distributions(self, seed, num_players, num_arms, mean_rewards):
-        np.random.seed(seed=seed)
-        sub_seeds = []
-        for player in range(num_players):
-            reward_distributions = []
-            for arm in range(num_arms):
-                sub_seed = np.random.randint(10000)
-                sub_seeds += [sub_seed]
-                reward_distributions += [BernoulliDistribution(p=min(1, mean_rewards[player][arm]),
-                                                               seed=sub_seed)]
-            self.reward_distributions += [reward_distributions]
-        print(sub_seeds)
+        # one Philox stream per (player, arm) pair, keyed by the seed and the pair, the global state is not used
+        buffer_size = self.reward_buffer_size if num_players * num_arms <= self.reward_buffer_max_pairs else None
+        self.reward_oracle = RewardOracle(means=np.minimum(1, mean_rewards[:num_players, :num_arms]),
+                                          seed=seed,
+                                          buffer_size=buffer_size)
 
     def sample_reward(self, player, arm, mean_rewards):
-        sample = self.reward_distributions[player][arm].sample()
-        self.collected_samples[player][arm] += [sample]
+        sample = self.reward_oracle.sample_one(player, arm)
+        self.samples.add_one(player, arm, sample)
         return sample
 
+    def sample_rewards(self, players, arms):
+        """
+        rewards of the pairs (players[i], arms[i]) drawn in one call
+        """
+        samples = self.reward_oracle.sample(players, arms)
+        self.samples.add(players, arms, samples)
+        return samples
+
+    def get_state(self):
+        """
+        state of a run as a flat dict of arrays: estimates, empirical orders, metric recorders, reward streams
+        and samples
+        """
+        state = {"num_plays": self.num_plays, "avg_players_reward": self.avg_players_reward}
+        state.update(prefixed("empirical_preferences", self.empirical_preferences.get_state()))
+        for recorder in self.recorders:
+            state.update(prefixed(recorder, getattr(self, recorder).get_state()))
+        state.update(prefixed("reward_oracle", self.reward_oracle.get_state()))
+        state.update(prefixed("samples", self.samples.get_state()))
+        return state
+
+    def set_state(self, state):
+        self.num_plays = np.array(state["num_plays"])
+        self.avg_players_reward = np.array(state["avg_players_reward"])
+        self.empirical_preferences.set_state(unprefixed("empirical_preferences", state))
+        for recorder in self.recorders:
+            getattr(self, recorder).set_state(unprefixed(recorder, state))
+        self.reward_oracle.set_state(unprefixed("reward_oracle", state))
+        self.samples.set_state(unprefixed("samples", state))
+        # the player optimal matching does not depend on the warm start, the matcher and the cache start again
+        self.empirical_matcher = IncrementalGaleShapley(player_preferences=self.empirical_preferences.order,
+                                                        arm_ranks=self.arm_ranks)
+        self.matcher_follows_empirical = True
+        self.match_cache = OrderedDict()
+
+    def set_checkpoint(self, path, rounds=None, seconds=None):
+        """ run saves a snapshot to path every rounds rounds and / or every seconds seconds """
+        self.checkpoint_path = path
+        self.checkpoint_rounds = rounds
+        self.checkpoint_seconds = seconds
+
+    def save_snapshot(self, path):
+        """ save the state of the run to a compressed .npz, written to a temporary file first """
+        temporary_path = path + ".tmp.npz"
+        np.savez_compressed(temporary_path, **self.get_state())
+        os.replace(temporary_path, path)
+
+    def load_snapshot(self, path):
+        """ restore a run saved by save_snapshot, run continues from it """
+        with np.load(path) as snapshot:
+            self.set_state({name: snapshot[name] for name in snapshot.files})
+
     def run(self):
         """ Implement the platform algorithm for the matching"""
         raise NotImplementedError("Please implement your platform method")
@@ -0,0 +1,49 @@
+"""
+Vectorized overlap tests of the confidence intervals of every player
+"""
+import numpy as np
+
+
+def count_at_most(values, members, queries, strict=False):
+    """
+    counts[p, q] number of j with members[p, j] and values[p, j] <= queries[p, q] (< if strict), with one sort per
+    player of its values and queries
+    """
+    num_values = values.shape[1]
+    # a stable sort keeps the values before the queries on ties for <=, after them for <
+    if strict:
+        combined = np.concatenate([queries, values], axis=1)
+        weights = np.concatenate([np.zeros(queries.shape, dtype=np.int64), members], axis=1)
+    else:
+        combined = np.concatenate([values, queries], axis=1)
+        weights = np.concatenate([members, np.zeros(queries.shape, dtype=np.int64)], axis=1)
+    order = np.argsort(combined, axis=1, kind="stable")
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+
+    query_offset = 0 if strict else num_values
+    is_query = (order >= query_offset) & (order < query_offset + queries.shape[1])
+    rows, positions = np.nonzero(is_query)
+    counts = np.empty(queries.shape, dtype=np.int64)
+    counts[rows, order[rows, positions] - query_offset] = cumulative[rows, positions]
+    return counts
+
+
+def overlap_counts(lower, upper, members):
+    """
+    counts[p, a] number of arms b != a with members[p, b] whose interval [lower, upper] overlaps the one of a.
+    As with Base_Elimination.is_overalping an undefined interval (NaN bounds, a pair never played) overlaps every
+    interval.
+
+    A valid b overlaps a iff lower_b <= upper_a and not upper_b < lower_a, the second set is included in the
+    first one so both are counted with a sort.
+    """
+    members = np.asarray(members, dtype=bool)
+    wild = np.isnan(lower) | np.isnan(upper)
+    valid_members = (members & ~wild).astype(np.int64)
+    safe_lower, safe_upper = np.where(wild, 0, lower), np.where(wild, 0, upper)
+
+    counts = count_at_most(safe_lower, valid_members, safe_upper) - \
+        count_at_most(safe_upper, valid_members, safe_lower, strict=True)
+    counts += (members & wild).sum(axis=1, keepdims=True)
+    counts -= members  # a member overlaps itself
+    return np.where(wild, members.sum(axis=1, keepdims=True) - members, counts)
@@ -0,0 +1,101 @@
+"""
+Empirical preference orders maintained while the means are updated
+"""
+import numpy as np
+
+
+class EmpiricalPreferences(object):
+    """
+    Preference lists of the players by decreasing empirical mean, ties broken by the arm index.
+
+    - order[p] is the preference list of player p and ranks[p, a] the position of arm a in it
+    - keys[p] are the negated means in the order of order[p], so every row is sorted in increasing order
+
+    When one mean changes the arm is moved to its new position with binary search, the arms in between are
+    shifted by one slot (a memmove) and only their ranks are rewritten, O(N) instead of sorting the row again.
+    Small instances sort the updated rows again. keys follow from values and order, so they are not saved in the
+    snapshots.
+    """
+    incremental_min_arms = 64  # with fewer arms sorting the updated rows again is faster than the numpy shifts
+
+    def __init__(self, means):
+        means = np.asarray(means, dtype=float)
+        self.num_players, self.num_arms = means.shape
+        self.values = means.copy()
+        self.order = np.argsort(-means, axis=1, kind="stable")
+        self.keys = np.take_along_axis(-means, self.order, axis=1)
+        self.ranks = np.empty_like(self.order)
+        np.put_along_axis(self.ranks, self.order, np.arange(self.num_arms)[None, :], axis=1)
+        # players whose order changed since the last pop_changed
+        self.changed = np.zeros(self.num_players, dtype=bool)
+
+    def preference_lists(self):
+        return self.order.tolist()
+
+    def update(self, players, arms, means):
+        """
+        set the means of the pairs (players[i], arms[i]) and return the players whose order changed, with moves
+        a player that got several updates can be returned even if its arms ended up in the same order
+        """
+        players = np.asarray(players, dtype=np.int64)
+        arms = np.asarray(arms, dtype=np.int64)
+        means = np.asarray(means, dtype=float)
+        if self.num_arms >= self.incremental_min_arms:
+            changed = [player for player, arm, mean in zip(players.tolist(), arms.tolist(), means.tolist())
+                       if self.move(player, arm, mean)]
+            changed = np.unique(np.array(changed, dtype=np.int64))
+            self.changed[changed] = True
+            return changed
+
+        self.values[players, arms] = means
+        order = np.argsort(-self.values[players], axis=1, kind="stable")
+        self.keys[players] = np.take_along_axis(-self.values[players], order, axis=1)
+        changed = (order != self.order[players]).any(axis=1)
+        if not changed.any():
+            return players[:0]
+        rows, order = players[changed], order[changed]
+        self.order[rows] = order
+        self.ranks[rows[:, None], order] = np.arange(self.num_arms)
+        self.changed[rows] = True
+        return np.unique(rows)
+
+    def pop_changed(self):
+        """ the players whose order changed since the last call """
+        changed = np.nonzero(self.changed)[0]
+        self.changed[:] = False
+        return changed
+
+    def move(self, player, arm, mean):
+        """ set one mean, returns True if the arm changed position """
+        self.values[player, arm] = mean
+        order, keys = self.order[player], self.keys[player]
+        old = self.ranks[player, arm]
+        key = -mean
+        # arms with a smaller key, then the arms with the same key in increasing index
+        left = np.searchsorted(keys, key, side="left")
+        right = np.searchsorted(keys, key, side="right")
+        new = left + np.searchsorted(order[left:right], arm)
+        if old < new:
+            new -= 1  # the arm itself was counted before its new position
+        if new > old:
+            order[old:new] = order[old + 1:new + 1]
+            keys[old:new] = keys[old + 1:new + 1]
+        elif new < old:
+            order[new + 1:old + 1] = order[new:old]
+            keys[new + 1:old + 1] = keys[new:old]
+        order[new] = arm
+        keys[new] = key
+        if new == old:
+            return False
+        low, high = min(old, new), max(old, new) + 1
+        self.ranks[player, order[low:high]] = np.arange(low, high)
+        return True
+
+    def get_state(self):
+        return {"values": self.values, "order": self.order, "ranks": self.ranks}
+
+    def set_state(self, state):
+        for name in ("values", "order", "ranks"):
+            setattr(self, name, np.array(state[name]))
+        self.keys = np.take_along_axis(-self.values, self.order, axis=1)
+        self.changed[:] = False
@@ -0,0 +1,47 @@
+"""
+Anytime PAC metrics of an elimination run
+"""
+import numpy as np
+
+
+class AnytimePacTracker(object):
+    """
+    The three anytime metrics of the empirical preference orders:
+    - pref_true: every empirical preference list is the true one
+    - pref_up_to_stable_match: every player ranks its optimal stable arm at its true rank
+    - optimal_stable: the player optimal matching of the empirical preferences is the true one
+
+    The orders are read from an EmpiricalPreferences, update only checks again the players whose order changed
+    and the stable matching is only recomputed when some order changed.
+    """
+
+    def __init__(self, empirical_preferences, player_preferences, optimal_match, matcher):
+        self.true_preferences = np.asarray(player_preferences, dtype=np.int64)
+        self.num_players = self.true_preferences.shape[0]
+        self.optimal_match = np.asarray(optimal_match, dtype=np.int64)
+        players = np.arange(self.num_players)
+        self.true_stable_rank = np.argsort(self.true_preferences, axis=1)[players, self.optimal_match]
+        self.matcher = matcher  # empirical preferences -> player optimal matching
+
+        self.empirical_preferences = empirical_preferences
+        self.wrong_preferences = np.zeros(self.num_players, dtype=bool)
+        self.wrong_stable_rank = np.zeros(self.num_players, dtype=bool)
+        self.optimal_stable = False
+        self.update()
+
+    def update(self, players=None):
+        """
+        metrics after the orders of the given players changed, all players when None
+        """
+        players = np.arange(self.num_players) if players is None else np.asarray(players, dtype=np.int64)
+        if len(players):
+            order, ranks = self.empirical_preferences.order, self.empirical_preferences.ranks
+            self.wrong_preferences[players] = (order[players] != self.true_preferences[players]).any(axis=1)
+            self.wrong_stable_rank[players] = ranks[players, self.optimal_match[players]] != \
+                self.true_stable_rank[players]
+            self.optimal_stable = bool(np.array_equal(self.matcher(order), self.optimal_match))
+        return self.metrics()
+
+    def metrics(self):
+        """ (pref_true, pref_up_to_stable_match, optimal_stable) """
+        return not self.wrong_preferences.any(), not self.wrong_stable_rank.any(), self.optimal_stable
@@ -0,0 +1,150 @@
+"""
+Independent replicates of one instance simulated together, for Monte Carlo estimates of the PAC failure rates
+"""
+import numpy as np
+import pandas as pd
+
+from matching.cetralised_platforms.pac.elimination_kernel import overlap_counts
+from matching.distributions.reward_oracle import ReplicatedRewardOracle
+from matching.matching_algo.gale_shapley import batched_gale_shapley
+from matching.matching_algo.is_stable import batch_is_stable
+from matching.utils import preferences_to_ranks
+
+
+class ReplicatedElimination(object):
+    """
+    R runs of an elimination algorithm on the same instance, one per seed, advanced round by round together.
+
+    The state of the runs is stacked in (R, N, N) arrays (reward sums, play counts, confidence intervals,
+    eliminated pairs) and the runs that stopped are masked out. Run r draws the rewards of
+    the algorithm with seed seeds[r], and every round samples each available pair once with
+    max degree matchings. So its final metrics are the ones of the single run. The anytime metrics of every
+    matching are not computed, only the last round with incorrect empirical preferences for max_pref.
+
+    rules: "NaiveUniformlySampling", "Elimination", "ImprovedElimination" and "AdapElimination"
+    """
+    rules = ("NaiveUniformlySampling", "Elimination", "ImprovedElimination", "AdapElimination")
+
+    def __init__(self, rule, delta, player_preferences, arm_preferences, mean_rewards_players, seeds):
+        if rule not in self.rules:
+            raise ValueError(f"unknown elimination rule {rule}")
+        self.rule = rule
+        self.delta = delta
+        self.player_preferences = np.asarray(player_preferences, dtype=np.int64)
+        self.arm_preferences = np.asarray(arm_preferences, dtype=np.int64)
+        self.num_players = self.player_preferences.shape[0]
+        self.player_ranks = preferences_to_ranks(player_preferences)
+        self.arm_ranks = preferences_to_ranks(arm_preferences)
+        self.optimal_match = batched_gale_shapley(proposer_preferences=self.player_preferences[None],
+                                                  receiver_ranks=np.asarray(self.arm_ranks)[None])[0][0]
+
+        mean_rewards = np.asarray(mean_rewards_players, dtype=float)
+        self.reward_oracle = ReplicatedRewardOracle(
+            means=np.minimum(1, mean_rewards[:self.num_players, :self.num_players]), seeds=seeds)
+        self.num_replicates = len(self.reward_oracle.seeds)
+        shape = (self.num_replicates, self.num_players, self.num_players)
+        self.reward_sums = np.zeros(shape, dtype=np.int64)
+        self.num_plays = np.zeros(shape, dtype=np.int64)
+        self.available_arms = np.zeros(shape)  # 0 for available, 1 for eliminated
+        self.running = np.ones(self.num_replicates, dtype=bool)
+
+        self.round = np.zeros(self.num_replicates, dtype=np.int64)
+        self.matching_rounds = np.zeros(self.num_replicates, dtype=np.int64)
+        self.num_samples = np.zeros(self.num_replicates, dtype=np.int64)
+        # index in pref_over_time of the last incorrect preferences, one entry per round
+        self.max_pref = np.zeros(self.num_replicates, dtype=np.int64)
+
+    def empirical_preferences(self, replicates):
+        """ preference lists by decreasing empirical mean, ties broken by the arm index, and their ranks """
+        sums, plays = self.reward_sums[replicates], self.num_plays[replicates]
+        means = np.divide(sums, plays, out=np.zeros(plays.shape), where=plays > 0)
+        order = np.argsort(-means, axis=2, kind="stable")
+        return means, order, preferences_to_ranks(order)
+
+    def empirical_match(self, order):
+        """ player optimal matchings of the (R', N, N) empirical preferences and the true arm preferences """
+        arm_ranks = np.broadcast_to(self.arm_ranks, order.shape)
+        return batched_gale_shapley(proposer_preferences=order, receiver_ranks=arm_ranks)[0]
+
+    def confidence_radius(self, replicates, plays):
+        if self.rule == "AdapElimination":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.sqrt(np.log((4 * (self.num_players ** 2) * (plays ** 2)) / self.delta) / (2 * plays))
+        t = self.round[replicates][:, None, None]
+        return np.sqrt(np.log((4 * (self.num_players ** 2) * (t ** 2)) / self.delta) / (2 * t))
+
+    def step(self):
+        """ one round of every running replicate """
+        replicates = np.nonzero(self.running)[0]
+        num_players = self.num_players
+        # pairs sampled in the round, every matching of the round samples each of its pairs once
+        if self.rule == "NaiveUniformlySampling":
+            sampled = np.ones((len(replicates), num_players, num_players), dtype=bool)
+        else:
+            sampled = self.available_arms[replicates] == 0
+        # the edge colouring of the sampled pairs has max degree matchings
+        num_matchings = np.maximum(sampled.sum(axis=2).max(axis=1), sampled.sum(axis=1).max(axis=1))
+
+        self.round[replicates] += 1
+        self.matching_rounds[replicates] += num_matchings
+        self.num_samples[replicates] += sampled.sum(axis=(1, 2))
+        rows, players, arms = np.nonzero(sampled)
+        rewards = self.reward_oracle.sample(replicates[rows], players, arms)
+        self.reward_sums[replicates[rows], players, arms] += rewards
+        self.num_plays[replicates[rows], players, arms] += 1
+
+        # confidence intervals and eliminations
+        means, order, ranks = self.empirical_preferences(replicates)
+        incorrect = ~(order == self.player_preferences).all(axis=(1, 2))
+        self.max_pref[replicates[incorrect]] = self.round[replicates[incorrect]] - 1
+        radius = self.confidence_radius(replicates, self.num_plays[replicates])
+        lower, upper = (means - radius).reshape(-1, num_players), (means + radius).reshape(-1, num_players)
+        if self.rule == "AdapElimination":
+            gs_match = self.empirical_match(order)
+            arms_to_check = ranks <= np.take_along_axis(ranks, gs_match[:, :, None], axis=2)
+            overlapping = overlap_counts(lower, upper, np.ones(lower.shape, dtype=bool)) > 0
+            overlapping_checked = overlap_counts(lower, upper, arms_to_check.reshape(lower.shape)) > 0
+            active = (arms_to_check.reshape(lower.shape) & overlapping) | overlapping_checked
+            available_arms = np.where(active, 0.0, 1.0).reshape(sampled.shape)
+        else:
+            available_arms = self.available_arms[replicates]
+            available = available_arms == 0
+            overlaps = overlap_counts(lower, upper, available.reshape(lower.shape)).reshape(sampled.shape)
+            available_arms[available & (overlaps == 0)] = 1
+        self.available_arms[replicates] = available_arms
+
+        # stopping rules
+        if self.rule == "ImprovedElimination":
+            gs_match = self.empirical_match(order)
+            arms_to_check = ranks <= np.take_along_axis(ranks, gs_match[:, :, None], axis=2)
+            running = (arms_to_check & (available_arms == 0)).any(axis=(1, 2))
+        else:
+            running = available_arms.sum(axis=(1, 2)) != num_players * num_players
+        self.running[replicates] = running
+
+    def run(self, max_rounds=None):
+        """ advance the replicates until all of them stopped, or for at most max_rounds rounds """
+        rounds = 0
+        while self.running.any() and (max_rounds is None or rounds < max_rounds):
+            self.step()
+            rounds += 1
+        return self.results()
+
+    def results(self):
+        """ the final metrics of every replicate, with the columns of run_instances """
+        replicates = np.arange(self.num_replicates)
+        _, order, _ = self.empirical_preferences(replicates)
+        final_match = self.empirical_match(order)
+        stable = batch_is_stable(final_match, player_ranks=self.player_ranks, arm_ranks=self.arm_ranks)
+        correct_preferences = (order == self.player_preferences).all(axis=(1, 2))
+        return pd.DataFrame({
+            "optimal_stable": (final_match == self.optimal_match).all(axis=1),
+            "stable:": stable,
+            "sample_complexity": self.matching_rounds + 1,
+            "rounds": self.round,
+            "samples": self.num_samples,
+            # the final preferences are the entry after the last round
+            "max_pref": np.where(correct_preferences, self.max_pref, self.round),
+            "correct_preferences": correct_preferences,
+            "running": self.running,
+        })
@@ -0,0 +1,172 @@
+"""
+Columnar store of the results of the runs of an algorithm
+"""
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# anytime metrics, one value per sampled matching
+TRACE_COLUMNS = {"pref_true": bool,
+                 "pref_up_to_stable_match": np.int64,
+                 "optimal_stable": bool,
+                 "round_id": np.int64,
+                 "matching_id": np.int64,
+                 "sample_id": np.int64}
+# one value per run, the traces of a run are the rows trace_start:trace_start + trace_length
+SUMMARY_COLUMNS = {"id": np.int64,
+                   "optimal_stable": bool,
+                   "stable:": bool,
+                   "sample_complexity": np.int64,
+                   "rounds": np.int64,
+                   "samples": np.int64,
+                   "max_pref": np.int64,
+                   "trace_start": np.int64,
+                   "trace_length": np.int64}
+KEY_COLUMNS = ("algorithm", "num_players", "instance", "delta")
+TABLES = {"runs": SUMMARY_COLUMNS, "traces": TRACE_COLUMNS}
+
+
+class ResultsStore(object):
+    """
+    Runs of one (algorithm, N, instance, δ), appended run by run to one raw file per column and read back as
+    memmaps, instead of one JSON file per run:
+    - runs/<column>.bin: the id and the summary metrics of every run and the slice of its rows in the traces
+    - traces/<column>.bin: the anytime metrics of every run one after the other
+    - key.json: the key of the runs
+
+    The traces of a run are written before its summary, a run appended partially (killed job) is dropped when
+    the store is opened again.
+    """
+    directory_name = "results_store"
+
+    def __init__(self, path, key=None):
+        self.path = path
+        for table in TABLES:
+            os.makedirs(os.path.join(path, table), exist_ok=True)
+        key_path = os.path.join(path, "key.json")
+        if os.path.isfile(key_path):
+            with open(key_path, "r") as file:
+                self.key = json.load(file)
+            if key is not None and key != self.key:
+                raise ValueError(f"the store {path} holds the runs of {self.key}, not {key}")
+        else:
+            if key is None:
+                raise ValueError(f"no store in {path}, a key is needed to create one")
+            self.key = dict(key)
+            with open(key_path, "w") as file:
+                json.dump(self.key, file)
+
+        self.num_runs = min(self.file_size("runs", name) // np.dtype(dtype).itemsize
+                            for name, dtype in SUMMARY_COLUMNS.items())
+        self.num_traces = 0
+        if self.num_runs:
+            self.num_traces = int(self.column("runs", "trace_start")[-1] + self.column("runs", "trace_length")[-1])
+        self.truncate()
+
+    def column_path(self, table, name):
+        return os.path.join(self.path, table, re.sub(r"\W", "_", name) + ".bin")
+
+    def file_size(self, table, name):
+        path = self.column_path(table, name)
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def table_size(self, table):
+        return self.num_runs if table == "runs" else self.num_traces
+
+    def truncate(self):
+        """ drop the values written after the last complete run """
+        for table, columns in TABLES.items():
+            for name, dtype in columns.items():
+                size = self.table_size(table) * np.dtype(dtype).itemsize
+                if self.file_size(table, name) > size:
+                    with open(self.column_path(table, name), "r+b") as file:
+                        file.truncate(size)
+
+    def append(self, run_id, summary, traces):
+        """ append a run: its summary metrics and its anytime metrics, dicts of the columns """
+        length = len(traces[next(iter(TRACE_COLUMNS))])
+        row = dict(summary, id=run_id, trace_start=self.num_traces, trace_length=length)
+        for table, values in (("traces", traces), ("runs", row)):
+            for name, dtype in TABLES[table].items():
+                with open(self.column_path(table, name), "ab") as file:
+                    file.write(np.asarray(values[name], dtype=dtype).tobytes())
+        self.num_traces += length
+        self.num_runs += 1
+
+    def column(self, table, name):
+        """ the values of a column as a read-only memmap """
+        size = self.table_size(table)
+        dtype = TABLES[table][name]
+        if size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.column_path(table, name), dtype=dtype, mode="r", shape=(size,))
+
+    def ids(self):
+        return set(self.column("runs", "id").tolist())
+
+    def summary(self, run_id):
+        """ the summary metrics of one run as Python values """
+        index = self.column("runs", "id").tolist().index(run_id)
+        return {name: self.column("runs", name)[index].item()
+                for name in SUMMARY_COLUMNS if name not in ("id", "trace_start", "trace_length")}
+
+    def keyed(self, columns, size):
+        frame = pd.DataFrame({name: np.full(size, self.key[name]) for name in KEY_COLUMNS})
+        for name, values in columns.items():
+            frame[name] = values
+        return frame
+
+    def runs(self):
+        """ DataFrame of the runs, one row per run """
+        return self.keyed({name: np.asarray(self.column("runs", name)) for name in SUMMARY_COLUMNS}, self.num_runs)
+
+    def traces(self):
+        """ DataFrame of the anytime metrics, one row per sampled matching, with the id of the run """
+        columns = {"id": np.repeat(self.column("runs", "id"), self.column("runs", "trace_length"))}
+        columns.update({name: np.asarray(self.column("traces", name)) for name in TRACE_COLUMNS})
+        return self.keyed(columns, self.num_traces)
+
+    def export(self, file_format=None):
+        """
+        write the runs and the traces as runs.parquet and traces.parquet, or results.npz without pyarrow,
+        returns the written paths
+        """
+        file_format = file_format or ("parquet" if pyarrow is not None else "npz")
+        if file_format == "parquet":
+            paths = []
+            for table, frame in (("runs", self.runs()), ("traces", self.traces())):
+                paths += [os.path.join(self.path, table + ".parquet")]
+                pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), paths[-1])
+            return paths
+        arrays = {f"{table}.{name}": np.asarray(self.column(table, name))
+                  for table, columns in TABLES.items() for name in columns}
+        path = os.path.join(self.path, "results.npz")
+        np.savez_compressed(path, key=json.dumps(self.key), **arrays)
+        return [path]
+
+
+def find_stores(root):
+    """ the results stores under a directory """
+    return [ResultsStore(directory) for directory, _, files in sorted(os.walk(root))
+            if os.path.basename(directory) == ResultsStore.directory_name and "key.json" in files]
+
+
+def load_results(root, traces=False):
+    """
+    DataFrame of the runs of every results store under root, keyed by (algorithm, num_players, instance, delta,
+    id), or of their anytime metrics if traces
+    """
+    frames = [store.traces() if traces else store.runs() for store in find_stores(root)]
+    if not frames:
+        columns = ["id"] + list(TRACE_COLUMNS) if traces else list(SUMMARY_COLUMNS)
+        return pd.DataFrame(columns=list(KEY_COLUMNS) + columns)
+    return pd.concat(frames, ignore_index=True)
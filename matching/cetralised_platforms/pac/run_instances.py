@@ -1,10 +1,61 @@
 """
 Here we iteratively run an algorithm for several runs each with a unique instance according to the setting
 """
+import multiprocessing
+import os
 import time
+
+import numpy as np
 from matching.cetralised_platforms.pac.cetralised_platform import CentralisedPlatform
 import pandas as pd
-from setup.utils import create_directory, save_json
+from matching.cetralised_platforms.pac.results_store import ResultsStore
+from setup.utils import create_directory, load_json, save_json
+
+
+def run_instance(task):
+    """
+    run one instance, task is (id, algorithm, keyword arguments of the algorithm, save_path, sample_store,
+    checkpoint). A run with a snapshot continues from it.
+    returns the summary metrics and the anytime metrics of the run
+    """
+    id, algorithm, kwargs, save_path, sample_store, checkpoint = task
+    print("try id", id)
+    start_time = time.time()
+    algo: CentralisedPlatform = algorithm(random_state=None,
+                                          sample_store=sample_store,
+                                          sample_directory=save_path + f"/id_{id}/samples",
+                                          **kwargs)
+    snapshot_path = save_path + f"/id_{id}/snapshot.npz"
+    if os.path.isfile(snapshot_path):
+        print(f"id {id} resumed")
+        algo.load_snapshot(snapshot_path)
+    if checkpoint is not None:
+        create_directory(save_path + f"/id_{id}")
+        algo.set_checkpoint(snapshot_path, **checkpoint)
+
+    algo.run()
+    print(f"id {id} time: {time.time() - start_time}")
+    print("")
+
+    if id == 1:
+        algo.samples.save(save_path)
+    algo.samples.close()
+    # get metrics
+    result = {
+        "optimal_stable": bool(algo.optimal_stable),
+        "stable:": bool(algo.stability),
+        "sample_complexity": int(algo.sample_complexity),
+        "rounds": int(algo.round),
+        "samples": int(algo.num_samples),
+        "max_pref": int(algo.max_pref)
+    }
+    traces = {name: np.array(values) for name, values in algo.anytime_metrics.get_state().items()}
+    return result, traces
+
+
+def instance_seeds(root_seed, num_instances):
+    """ independent seeds of the instances spawned from one root seed """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(root_seed).spawn(num_instances)]
 
 
 def run_instances(algorithm,
@@ -16,42 +67,76 @@ def run_instances(algorithm,
                   num_players,
                   variance,
                   seeds,
-                  save_path):
-    results = []
+                  save_path,
+                  sample_store="off",
+                  workers=1,
+                  chunksize=1,
+                  checkpoint_rounds=None,
+                  checkpoint_seconds=None,
+                  results_key=None,
+                  root_seed=None):
+    """
+    run the algorithm on every instance, with workers > 1 the instances are run by a process pool.
+    The rewards of an instance only depend on its seed, so the results do not depend on the number of workers and
+    are saved in the order of the instances. seeds=None spawns the seeds from root_seed, a random one if None,
+    which is saved in root_seed.json and in the root_seed column of the results, a sweep run again reuses it.
+    root_seed is ignored with explicit seeds.
+
+    The summary and the anytime metrics of every run are appended to the ResultsStore of save_path, keyed by
+    results_key (algorithm, num_players, instance, delta) and the id of the instance. Instances already in the
+    store are skipped and the runs snapshot every checkpoint_rounds rounds or checkpoint_seconds seconds continue
+    from their snapshot, so a killed sweep can be run again with the same arguments.
+    """
     instances = len(true_players_rankings)
-    for id in range(instances):
-        print("try id", id)
-        start_time = time.time()
-        algo: CentralisedPlatform = algorithm(delta=delta,
-                                              player_preferences=true_players_rankings[id],
-                                              arm_preferences=true_arm_rankings[id],
-                                              mean_rewards_players=mean_rewards_players[id],
-                                              mean_rewards_arm=mean_rewards_arms[id],
-                                              num_players=num_players,
-                                              variance=variance,
-                                              seed=seeds[id],
-                                              random_state=None)
-
-        algo.run()
-        create_directory(save_path + f"/id_{id}")
-        print(f"id {id} time: {time.time() - start_time}")
-        print("")
-        algo.save_results(save_path + f"/id_{id}")
-
-        # get metrics
-        results += [{
-            "optimal_stable": algo.optimal_stable,
-            "stable:": algo.stability,
-            "sample_complexity": algo.sample_complexity,
-            "rounds": algo.round,
-            "samples": algo.num_samples,
-            "max_pref": algo.max_pref
-        }]
-
-        if id == 1:
-            save_json(algo.collected_samples, save_path + '/collected_samples.json')
-            # pd.DataFrame(algo.collected_samples).to_csv(save_path + '/collected_samples.csv')
+    if results_key is None:
+        results_key = {"algorithm": algorithm.__name__, "num_players": num_players, "instance": 0, "delta": delta}
+    store = ResultsStore(save_path + "/" + ResultsStore.directory_name, key=results_key)
+    completed = store.ids()
+    spawned_seeds = seeds is None
+    if spawned_seeds:
+        root_seed_path = save_path + "/root_seed.json"
+        if root_seed is None:
+            root_seed = load_json(root_seed_path) if os.path.isfile(root_seed_path) else \
+                np.random.SeedSequence().entropy
+        save_json(int(root_seed), root_seed_path)
+        seeds = instance_seeds(root_seed, instances)
+    checkpoint = None
+    if checkpoint_rounds is not None or checkpoint_seconds is not None:
+        checkpoint = {"rounds": checkpoint_rounds, "seconds": checkpoint_seconds}
+    tasks = [(id,
+              algorithm,
+              dict(delta=delta,
+                   player_preferences=true_players_rankings[id],
+                   arm_preferences=true_arm_rankings[id],
+                   mean_rewards_players=mean_rewards_players[id],
+                   mean_rewards_arm=mean_rewards_arms[id],
+                   num_players=num_players,
+                   variance=variance,
+                   seed=seeds[id]),
+              save_path,
+              sample_store,
+              checkpoint) for id in range(instances) if id not in completed]
+    for id in sorted(completed):
+        print(f"id {id} already completed")
+
+    def finish(task, run):
+        # the run is completed once it is in the store, its snapshot is not needed anymore
+        store.append(task[0], *run)
+        snapshot_path = save_path + f"/id_{task[0]}/snapshot.npz"
+        for path in (snapshot_path, snapshot_path + ".tmp.npz"):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    if workers <= 1:
+        for task in tasks:
+            finish(task, run_instance(task))
+    else:
+        with multiprocessing.Pool(processes=workers) as pool:
+            for task, run in zip(tasks, pool.imap(run_instance, tasks, chunksize=chunksize)):
+                finish(task, run)
     # save
-    results = pd.DataFrame(results)
+    results = pd.DataFrame([store.summary(id) for id in range(instances)])
+    if spawned_seeds:
+        results["root_seed"] = root_seed
     results.to_csv(save_path + '/results.csv')
     return results
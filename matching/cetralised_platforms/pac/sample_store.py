@@ -0,0 +1,197 @@
+"""
+Stores of the rewards sampled by a platform
+"""
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+
+class SampleStore(object):
+    """
+    "off" store: only the sufficient statistics of every (player, arm) pair are kept, O(N^2) memory
+    """
+    mode = "off"
+
+    def __init__(self, num_players, num_arms, dtype=np.uint8, directory=None):
+        # directory of the files of the store, only the "full" store writes files
+        self.num_players = num_players
+        self.num_arms = num_arms
+        self.dtype = np.dtype(dtype)
+        self.counts = np.zeros((num_players, num_arms), dtype=np.int64)
+        self.sums = np.zeros((num_players, num_arms))
+        self.sums_of_squares = np.zeros((num_players, num_arms))
+
+    def add(self, players, arms, samples):
+        """ record samples[i] for the pair (players[i], arms[i]), pairs can repeat """
+        samples = np.asarray(samples, dtype=float)
+        np.add.at(self.counts, (players, arms), 1)
+        np.add.at(self.sums, (players, arms), samples)
+        np.add.at(self.sums_of_squares, (players, arms), samples ** 2)
+
+    def add_one(self, player, arm, sample):
+        self.counts[player, arm] += 1
+        self.sums[player, arm] += sample
+        self.sums_of_squares[player, arm] += sample * sample
+
+    def means(self):
+        return np.divide(self.sums, self.counts, out=np.zeros_like(self.sums), where=self.counts > 0)
+
+    def samples(self, player, arm):
+        raise ValueError(f'the "{self.mode}" sample store does not keep the samples, use "compact" or "full"')
+
+    def save(self, save_path):
+        np.savez(save_path + "/sample_statistics.npz",
+                 counts=self.counts, sums=self.sums, sums_of_squares=self.sums_of_squares)
+
+    def get_state(self):
+        return {"counts": self.counts, "sums": self.sums, "sums_of_squares": self.sums_of_squares}
+
+    def set_state(self, state):
+        self.counts = np.array(state["counts"])
+        self.sums = np.array(state["sums"])
+        self.sums_of_squares = np.array(state["sums_of_squares"])
+
+    def close(self):
+        """ end of the run, releases the files of the store """
+
+
+class CompactSampleStore(SampleStore):
+    """
+    "compact" store: the samples of every pair in a growable array of the sample dtype (uint8 for Bernoulli
+    rewards, float32 for normal rewards)
+    """
+    mode = "compact"
+    initial_capacity = 16
+
+    def __init__(self, num_players, num_arms, dtype=np.uint8, directory=None):
+        SampleStore.__init__(self, num_players=num_players, num_arms=num_arms, dtype=dtype)
+        self.values = [np.empty(0, dtype=self.dtype) for _ in range(num_players * num_arms)]
+        self.sizes = [0] * (num_players * num_arms)
+
+    def append(self, player, arm, sample):
+        pair_id = player * self.num_arms + arm
+        size = self.sizes[pair_id]
+        values = self.values[pair_id]
+        if size == len(values):
+            # geometric growth, amortized O(1) appends
+            values = np.resize(values, max(self.initial_capacity, 2 * len(values)))
+            self.values[pair_id] = values
+        values[size] = sample
+        self.sizes[pair_id] = size + 1
+
+    def add(self, players, arms, samples):
+        for player, arm, sample in zip(np.asarray(players).tolist(), np.asarray(arms).tolist(),
+                                       np.asarray(samples).tolist()):
+            self.append(player, arm, sample)
+        SampleStore.add(self, players, arms, samples)
+
+    def add_one(self, player, arm, sample):
+        self.append(player, arm, sample)
+        SampleStore.add_one(self, player, arm, sample)
+
+    def samples(self, player, arm):
+        pair_id = player * self.num_arms + arm
+        return self.values[pair_id][:self.sizes[pair_id]]
+
+    def concatenated(self):
+        """ samples of every pair one after the other in pair id order, offsets index the pairs """
+        values = np.concatenate([values[:size] for values, size in zip(self.values, self.sizes)])
+        return np.r_[0, np.cumsum(self.sizes)], values
+
+    def save(self, save_path):
+        offsets, values = self.concatenated()
+        np.savez(save_path + "/collected_samples.npz", offsets=offsets, values=values, shape=self.counts.shape)
+
+    def get_state(self):
+        offsets, values = self.concatenated()
+        return dict(SampleStore.get_state(self), offsets=offsets, values=values)
+
+    def set_state(self, state):
+        SampleStore.set_state(self, state)
+        offsets, values = state["offsets"], np.asarray(state["values"], dtype=self.dtype)
+        self.values = [values[start:end].copy() for start, end in zip(offsets[:-1], offsets[1:])]
+        self.sizes = np.diff(offsets).tolist()
+
+
+class FullSampleStore(SampleStore):
+    """
+    "full" store: every sample is appended in draw order to raw files on disk, readable as memmaps.
+
+    The files are written in directory, or in a temporary directory removed by close (or when the store is
+    garbage collected) if it is None.
+    """
+    mode = "full"
+
+    def __init__(self, num_players, num_arms, dtype=np.uint8, directory=None):
+        SampleStore.__init__(self, num_players=num_players, num_arms=num_arms, dtype=dtype)
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix="samples_")
+            self.remove_directory = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+        else:
+            self.directory = directory
+            self.remove_directory = None
+            os.makedirs(directory, exist_ok=True)
+        self.pairs_file = open(os.path.join(self.directory, "pairs.bin"), "wb")
+        self.values_file = open(os.path.join(self.directory, "values.bin"), "wb")
+        self.num_samples = 0
+
+    def add(self, players, arms, samples):
+        pair_ids = np.asarray(players, dtype=np.uint32) * self.num_arms + np.asarray(arms, dtype=np.uint32)
+        self.pairs_file.write(pair_ids.astype(np.uint32).tobytes())
+        self.values_file.write(np.asarray(samples).astype(self.dtype).tobytes())
+        self.num_samples += pair_ids.size
+        SampleStore.add(self, players, arms, samples)
+
+    def add_one(self, player, arm, sample):
+        self.add([player], [arm], [sample])
+
+    def memmap(self):
+        """ (pair ids, samples) in draw order """
+        if not self.pairs_file.closed:
+            self.pairs_file.flush()
+            self.values_file.flush()
+        if self.num_samples == 0:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=self.dtype)
+        pairs = np.memmap(self.pairs_file.name, dtype=np.uint32, mode="r", shape=(self.num_samples,))
+        values = np.memmap(self.values_file.name, dtype=self.dtype, mode="r", shape=(self.num_samples,))
+        return pairs, values
+
+    def samples(self, player, arm):
+        pairs, values = self.memmap()
+        return np.asarray(values[pairs == player * self.num_arms + arm])
+
+    def save(self, save_path):
+        pairs, values = self.memmap()
+        np.savez(save_path + "/collected_samples.npz", pairs=pairs, values=values, shape=self.counts.shape)
+
+    def get_state(self):
+        pairs, values = self.memmap()
+        return dict(SampleStore.get_state(self), pairs=np.array(pairs), values=np.array(values))
+
+    def set_state(self, state):
+        """ the files are rewritten with the samples of the state """
+        SampleStore.set_state(self, state)
+        self.pairs_file.close()
+        self.values_file.close()
+        self.pairs_file = open(self.pairs_file.name, "wb")
+        self.values_file = open(self.values_file.name, "wb")
+        self.pairs_file.write(np.asarray(state["pairs"], dtype=np.uint32).tobytes())
+        self.values_file.write(np.asarray(state["values"], dtype=self.dtype).tobytes())
+        self.num_samples = len(state["pairs"])
+
+    def close(self):
+        """ close the files, a temporary directory is removed with them """
+        self.pairs_file.close()
+        self.values_file.close()
+        if self.remove_directory is not None:
+            self.remove_directory()
+
+
+sample_stores = {
+    "off": SampleStore,
+    "compact": CompactSampleStore,
+    "full": FullSampleStore,
+}
@@ -0,0 +1,356 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from experiments.pac.generate_instances.gen_instances import generate_instance
+from matching.cetralised_platforms.pac.empirical_preferences import EmpiricalPreferences
+from matching.cetralised_platforms.pac.get_algo import pac_algorithms
+from matching.cetralised_platforms.pac.replicates import ReplicatedElimination
+from matching.cetralised_platforms.pac import results_store
+from matching.cetralised_platforms.pac.results_store import ResultsStore, TRACE_COLUMNS, SUMMARY_COLUMNS, \
+    load_results
+from matching.cetralised_platforms.pac.run_instances import run_instances
+from matching.cetralised_platforms.pac.sample_store import sample_stores
+from setup.utils import load_json
+
+
+def random_samples(rng, num_players, num_samples):
+    players = rng.integers(0, num_players, num_samples)
+    arms = rng.integers(0, num_players, num_samples)
+    samples = rng.integers(0, 2, num_samples)
+    return players, arms, samples
+
+
+def small_instances(num_instances, num_players, seed=0):
+    """ instances of generate_instance: (player means, player rankings, arm means, arm rankings) and seeds """
+    np.random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        instances, _, seeds = generate_instance(num_instances, num_players, 0.1)
+    return instances, seeds
+
+
+def run_small_instances(instances, save_path, algorithm="AdapElimination", **kwargs):
+    mean_rewards_players, players_rankings, mean_rewards_arms, arm_rankings = instances
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_instances(algorithm=pac_algorithms[algorithm],
+                             delta=0.1,
+                             true_players_rankings=players_rankings,
+                             true_arm_rankings=arm_rankings,
+                             mean_rewards_players=mean_rewards_players,
+                             mean_rewards_arms=mean_rewards_arms,
+                             num_players=len(players_rankings[0]),
+                             variance=1,
+                             save_path=save_path,
+                             **kwargs)
+
+
+def test_sample_stores():
+    """
+    "off" keeps only the counts and sums, "compact" and "full" give back the samples of every pair through
+    samples, get_state / set_state and save
+    """
+    rng = np.random.default_rng(0)
+    num_players_test = 4
+    players, arms, samples = random_samples(rng, num_players_test, 200)
+    expected_counts = np.zeros((num_players_test, num_players_test), dtype=np.int64)
+    np.add.at(expected_counts, (players, arms), 1)
+    expected_sums = np.zeros((num_players_test, num_players_test))
+    np.add.at(expected_sums, (players, arms), samples)
+
+    for mode, store_class in sample_stores.items():
+        store = store_class(num_players=num_players_test, num_arms=num_players_test)
+        store.add(players[:150], arms[:150], samples[:150])
+        for player, arm, sample in zip(players[150:], arms[150:], samples[150:]):
+            store.add_one(player, arm, sample)
+        assert np.array_equal(store.counts, expected_counts)
+        assert np.array_equal(store.sums, expected_sums)
+
+        restored = store_class(num_players=num_players_test, num_arms=num_players_test)
+        restored.set_state(store.get_state())
+        with tempfile.TemporaryDirectory() as save_path:
+            store.save(save_path)
+            if mode == "off":
+                assert set(store.get_state()) == {"counts", "sums", "sums_of_squares"}
+                assert os.listdir(save_path) == ["sample_statistics.npz"]
+                try:
+                    store.samples(0, 0)
+                    assert False, "the off store does not keep the samples"
+                except ValueError:
+                    pass
+                continue
+
+            with np.load(save_path + "/collected_samples.npz") as saved:
+                saved = {name: saved[name] for name in saved.files}
+        for player in range(num_players_test):
+            for arm in range(num_players_test):
+                pair_samples = samples[(players == player) & (arms == arm)]
+                assert np.array_equal(store.samples(player, arm), pair_samples)
+                assert np.array_equal(restored.samples(player, arm), pair_samples)
+                pair_id = player * num_players_test + arm
+                if mode == "compact":
+                    saved_samples = saved["values"][saved["offsets"][pair_id]:saved["offsets"][pair_id + 1]]
+                else:
+                    saved_samples = saved["values"][saved["pairs"] == pair_id]
+                assert np.array_equal(saved_samples, pair_samples)
+        assert np.array_equal(restored.counts, expected_counts)
+        store.close()
+        restored.close()
+    print("End")
+
+
+def test_root_seed():
+    """
+    without seeds the instances are seeded from the root seed: one or two workers write the same results.csv, and a
+    random root seed is saved with the results and gives the same results again. Explicit seeds ignore the root seed
+    """
+    instances, seeds = small_instances(num_instances=4, num_players=3)
+    results_csv = []
+    for workers in [1, 2]:
+        with tempfile.TemporaryDirectory() as save_path:
+            run_small_instances(instances, save_path, seeds=None, root_seed=3, workers=workers)
+            with open(save_path + "/results.csv", "r") as file:
+                results_csv.append(file.read())
+            assert load_json(save_path + "/root_seed.json") == 3
+    assert results_csv[0] == results_csv[1]
+
+    with tempfile.TemporaryDirectory() as save_path, tempfile.TemporaryDirectory() as replay_path:
+        results = run_small_instances(instances, save_path, seeds=None)
+        root_seed = load_json(save_path + "/root_seed.json")
+        assert (results["root_seed"] == root_seed).all()
+        replayed = run_small_instances(instances, replay_path, seeds=None, root_seed=root_seed, workers=2)
+        assert results.equals(replayed)
+
+    # explicit seeds ignore the root seed, which is then not recorded
+    with tempfile.TemporaryDirectory() as save_path:
+        results = run_small_instances(instances, save_path, seeds=seeds, root_seed=3)
+        assert "root_seed" not in results and not os.path.isfile(save_path + "/root_seed.json")
+    print("End")
+
+
+def test_replicated_elimination():
+    """
+    the replicates of every elimination rule end with the final metrics of the single runs of their seeds
+    """
+    (mean_rewards_players, players_rankings, _, arm_rankings), _ = small_instances(num_instances=1, num_players=5)
+    seeds = [100, 101, 102]
+    for rule in ReplicatedElimination.rules:
+        replicates = ReplicatedElimination(rule, 0.1, players_rankings[0], arm_rankings[0], mean_rewards_players[0],
+                                           seeds)
+        results = replicates.run()
+        assert not results["running"].any()
+        for seed, (_, replicate) in zip(seeds, results.iterrows()):
+            algorithm = pac_algorithms[rule](delta=0.1,
+                                             player_preferences=players_rankings[0],
+                                             arm_preferences=arm_rankings[0],
+                                             num_players=5,
+                                             mean_rewards_players=mean_rewards_players[0],
+                                             variance=1,
+                                             seed=seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                algorithm.run()
+            assert bool(replicate["optimal_stable"]) == bool(algorithm.optimal_stable)
+            assert bool(replicate["stable:"]) == bool(algorithm.stability)
+            assert replicate["sample_complexity"] == algorithm.sample_complexity
+            assert replicate["rounds"] == algorithm.round
+            assert replicate["samples"] == algorithm.num_samples
+            assert replicate["max_pref"] == algorithm.max_pref
+    print("End")
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_snapshot_resume():
+    """
+    a run killed after a snapshot and resumed from it ends in the state of the run that was not interrupted
+    """
+    (mean_rewards_players, players_rankings, _, arm_rankings), seeds = small_instances(num_instances=1,
+                                                                                      num_players=4)
+
+    def algorithm(rule):
+        return pac_algorithms[rule](delta=0.1,
+                                    player_preferences=players_rankings[0],
+                                    arm_preferences=arm_rankings[0],
+                                    num_players=4,
+                                    mean_rewards_players=mean_rewards_players[0],
+                                    variance=1,
+                                    seed=seeds[0])
+
+    with tempfile.TemporaryDirectory() as snapshot_directory:
+        snapshot_path = snapshot_directory + "/snapshot.npz"
+        for rule in ReplicatedElimination.rules:
+            with contextlib.redirect_stdout(io.StringIO()):
+                reference = algorithm(rule)
+                reference.run()
+
+                interrupted = algorithm(rule)
+                interrupted.set_checkpoint(snapshot_path, rounds=10)
+
+                def save_and_stop(path, save_snapshot=interrupted.save_snapshot):
+                    save_snapshot(path)
+                    raise Interrupted()
+
+                interrupted.save_snapshot = save_and_stop
+                try:
+                    interrupted.run()
+                    assert False, "the run ends after its first snapshot"
+                except Interrupted:
+                    pass
+
+                resumed = algorithm(rule)
+                resumed.load_snapshot(snapshot_path)
+                assert 0 < resumed.round < reference.round
+                resumed.run()
+
+            assert resumed.round == reference.round
+            assert np.array_equal(resumed.num_plays, reference.num_plays)
+            assert np.array_equal(resumed.avg_players_reward, reference.avg_players_reward)
+            resumed_metrics = resumed.anytime_metrics.get_state()
+            reference_metrics = reference.anytime_metrics.get_state()
+            assert set(resumed_metrics) == set(reference_metrics)
+            for name in reference_metrics:
+                assert np.array_equal(resumed_metrics[name], reference_metrics[name])
+            assert (resumed.optimal_stable, resumed.sample_complexity, resumed.max_pref) == \
+                (reference.optimal_stable, reference.sample_complexity, reference.max_pref)
+    print("End")
+
+
+def random_run(rng):
+    """ summary metrics and anytime metrics of a run """
+    summary = {"optimal_stable": bool(rng.integers(2)),
+               "stable:": bool(rng.integers(2)),
+               "sample_complexity": int(rng.integers(100)),
+               "rounds": int(rng.integers(100)),
+               "samples": int(rng.integers(100)),
+               "max_pref": int(rng.integers(100))}
+    length = int(rng.integers(1, 10))
+    traces = {name: rng.integers(0, 2 if dtype is bool else 100, length).astype(dtype)
+              for name, dtype in TRACE_COLUMNS.items()}
+    return summary, traces
+
+
+def test_results_store():
+    """
+    a run appended partially is dropped when the store is opened again, the complete runs are read back by ids,
+    summary, load_results and export
+    """
+    rng = np.random.default_rng(1)
+    keys = [{"algorithm": "Elimination", "num_players": 3, "instance": 1, "delta": 0.1},
+            {"algorithm": "AdapElimination", "num_players": 3, "instance": 1, "delta": 0.1}]
+    with tempfile.TemporaryDirectory() as root:
+        runs = {}
+        for number, key in enumerate(keys):
+            store = ResultsStore(root + f"/{key['algorithm']}/" + ResultsStore.directory_name, key=key)
+            for run_id in [2, 0, 1][:number + 2]:
+                runs[key["algorithm"], run_id] = random_run(rng)
+                store.append(run_id, *runs[key["algorithm"], run_id])
+
+        # a job killed while appending: the traces and the first summary columns of run 5 are written
+        summary, traces = random_run(rng)
+        for name, dtype in TRACE_COLUMNS.items():
+            with open(store.column_path("traces", name), "ab") as file:
+                file.write(np.asarray(traces[name], dtype=dtype).tobytes())
+        for name in list(SUMMARY_COLUMNS)[:3]:
+            with open(store.column_path("runs", name), "ab") as file:
+                value = 5 if name == "id" else summary.get(name, 0)
+                file.write(np.asarray(value, dtype=SUMMARY_COLUMNS[name]).tobytes())
+
+        reopened = ResultsStore(store.path)
+        assert reopened.key == keys[1] and reopened.ids() == {0, 1, 2}
+        assert reopened.num_traces == sum(len(runs["AdapElimination", run_id][1]["round_id"]) for run_id in range(3))
+        for table, columns in (("runs", SUMMARY_COLUMNS), ("traces", TRACE_COLUMNS)):
+            for name, dtype in columns.items():
+                assert reopened.file_size(table, name) == reopened.table_size(table) * np.dtype(dtype).itemsize
+        for run_id in range(3):
+            assert reopened.summary(run_id) == runs["AdapElimination", run_id][0]
+        try:
+            ResultsStore(store.path, key=keys[0])
+            assert False, "the key of a store can not change"
+        except ValueError:
+            pass
+        # a run appended after the recovery follows the complete runs
+        runs["AdapElimination", 5] = random_run(rng)
+        reopened.append(5, *runs["AdapElimination", 5])
+
+        results = load_results(root)
+        assert len(results) == len(runs)
+        for _, row in results.iterrows():
+            summary, _ = runs[row["algorithm"], row["id"]]
+            assert all(row[name] == value for name, value in summary.items())
+            assert row["num_players"] == 3 and row["instance"] == 1 and row["delta"] == 0.1
+        traces = load_results(root, traces=True)
+        for (algorithm, run_id), (_, run_traces) in runs.items():
+            rows = traces[(traces["algorithm"] == algorithm) & (traces["id"] == run_id)]
+            for name in TRACE_COLUMNS:
+                assert np.array_equal(rows[name].to_numpy(), run_traces[name])
+        with tempfile.TemporaryDirectory() as empty_root:
+            assert load_results(empty_root).empty
+
+        for path in ResultsStore(store.path).export(file_format="npz"):
+            with np.load(path) as exported:
+                assert json.loads(str(exported["key"])) == keys[1]
+                assert np.array_equal(exported["runs.id"], [2, 0, 1, 5])
+                for name in TRACE_COLUMNS:
+                    assert np.array_equal(exported["traces." + name], np.concatenate(
+                        [runs["AdapElimination", run_id][1][name] for run_id in [2, 0, 1, 5]]))
+        if results_store.pyarrow is not None:
+            runs_path, traces_path = reopened.export(file_format="parquet")
+            assert pd.read_parquet(runs_path).equals(reopened.runs())
+            assert pd.read_parquet(traces_path).equals(reopened.traces())
+    print("End")
+
+
+def test_empirical_preferences():
+    """
+    after random updates and moves, with ties between the means, the orders are the stable argsort of the negated
+    means on both the small (sorted again) and the incremental (moved) paths, and they survive a snapshot
+    """
+    rng = np.random.default_rng(2)
+    for num_arms in [5, EmpiricalPreferences.incremental_min_arms + 6]:
+        num_players_test = 4
+        # few distinct means so that ties are frequent
+        means = rng.integers(0, 4, (num_players_test, num_arms)) / 4
+        preferences = EmpiricalPreferences(means)
+        for step in range(300):
+            order_before = preferences.order.copy()
+            if step % 3:
+                size = rng.integers(1, 2 * num_players_test)
+                players = rng.integers(0, num_players_test, size)
+                arms = rng.integers(0, num_arms, size)
+                new_means = rng.integers(0, 4, size) / 4
+                changed = preferences.update(players, arms, new_means)
+                means[players, arms] = new_means
+            else:
+                player, arm, mean = rng.integers(num_players_test), rng.integers(num_arms), rng.integers(0, 4) / 4
+                moved = preferences.move(player, arm, mean)
+                means[player, arm] = mean
+                changed = [player] if moved else []
+                assert moved == (preferences.order[player] != order_before[player]).any()
+            expected = np.argsort(-means, axis=1, kind="stable")
+            assert np.array_equal(preferences.order, expected)
+            assert np.array_equal(np.take_along_axis(preferences.ranks, expected, axis=1),
+                                  np.tile(np.arange(num_arms), (num_players_test, 1)))
+            assert np.array_equal(preferences.keys, np.take_along_axis(-means, expected, axis=1))
+            # every player whose order changed is reported
+            assert set(np.nonzero((preferences.order != order_before).any(axis=1))[0]) <= set(np.asarray(changed))
+
+        restored = EmpiricalPreferences(np.zeros((num_players_test, num_arms)))
+        restored.set_state(preferences.get_state())
+        for name in ("values", "order", "keys", "ranks"):
+            assert np.array_equal(getattr(restored, name), getattr(preferences, name))
+    print("End")
+
+
+if __name__ == "__main__":
+    test_sample_stores()
+    test_root_seed()
+    test_replicated_elimination()
+    test_snapshot_resume()
+    test_results_store()
+    test_empirical_preferences()
@@ -0,0 +1,64 @@
+"""
+Recorder of the metrics of a run
+"""
+import numpy as np
+
+
+class TimeSeriesRecorder(object):
+    """
+    Append-only time series with typed columns.
+
+    Every column is a preallocated array that doubles when full, so appending is amortized O(1) and the values
+    are stored unboxed. columns maps a name to a dtype, or to (dtype, shape) for vector valued columns.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self.names = list(columns)
+        self.size = 0
+        self.capacity = capacity
+        self.columns = {}
+        for name, spec in columns.items():
+            dtype, shape = spec if isinstance(spec, tuple) else (spec, ())
+            shape = (shape,) if isinstance(shape, int) else tuple(shape)
+            self.columns[name] = np.empty((capacity,) + shape, dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        self.capacity *= 2
+        for name, values in self.columns.items():
+            grown = np.empty((self.capacity,) + values.shape[1:], dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+
+    def append(self, *values, **named_values):
+        """ append one row, values in the order of the columns or by name """
+        if self.size == self.capacity:
+            self.grow()
+        for name, value in zip(self.names, values):
+            self.columns[name][self.size] = value
+        for name, value in named_values.items():
+            self.columns[name][self.size] = value
+        self.size += 1
+
+    def to_numpy(self, name=None):
+        """ view of the recorded values of a column, the only column by default """
+        if name is None:
+            name, = self.names
+        return self.columns[name][:self.size]
+
+    def to_list(self, name=None):
+        return self.to_numpy(name).tolist()
+
+    def get_state(self):
+        return {name: self.to_numpy(name) for name in self.names}
+
+    def set_state(self, state):
+        """ replace the recorded values by the ones of get_state """
+        self.size = len(state[self.names[0]])
+        self.capacity = max(self.capacity, self.size)
+        for name in self.names:
+            values = np.empty((self.capacity,) + self.columns[name].shape[1:], dtype=self.columns[name].dtype)
+            values[:self.size] = state[name]
+            self.columns[name] = values
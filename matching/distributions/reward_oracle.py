@@ -0,0 +1,236 @@
+"""
+Reward oracle drawing the rewards of many (player, arm) pairs in one call.
+"""
+from array import array
+
+import numpy as np
+
+# Philox4x64-10 constants (Salmon et al., Random123), multipliers split in 32 bit halves
+PHILOX_M0 = 0xD2E7470EE14C6C93
+PHILOX_M1 = 0xCA5A826395121157
+PHILOX_W0 = np.array(0x9E3779B97F4A7C15, dtype=np.uint64)
+PHILOX_W1 = np.array(0xBB67AE8584CAA73B, dtype=np.uint64)
+LOW_BITS = np.array(0xFFFFFFFF, dtype=np.uint64)
+SHIFT = np.array(32, dtype=np.uint64)
+
+
+def split_multiplier(multiplier):
+    return tuple(np.array(value, dtype=np.uint64) for value in (multiplier, multiplier & 0xFFFFFFFF, multiplier >> 32))
+
+
+def mulhilo(a, multiplier):
+    """ high and low 64 bits of the 128 bit products of the uint64 array a and a split multiplier """
+    b, b_lo, b_hi = multiplier
+    a_lo, a_hi = a & LOW_BITS, a >> SHIFT
+    lo_hi, hi_lo = a_lo * b_hi, a_hi * b_lo
+    middle = ((a_lo * b_lo) >> SHIFT) + (lo_hi & LOW_BITS) + (hi_lo & LOW_BITS)
+    hi = a_hi * b_hi + (lo_hi >> SHIFT) + (hi_lo >> SHIFT) + (middle >> SHIFT)
+    return hi, a * b
+
+
+def philox4x64(counter, key, rounds=10):
+    """
+    Philox4x64 blocks of the (4, n) counters under the (2, n) keys, same output as np.random.Philox
+    """
+    c0, c1, c2, c3 = (np.asarray(word, dtype=np.uint64) for word in counter)
+    k0, k1 = (np.asarray(word, dtype=np.uint64) for word in key)
+    m0, m1 = split_multiplier(PHILOX_M0), split_multiplier(PHILOX_M1)
+    for i in range(rounds):
+        if i > 0:
+            k0, k1 = k0 + PHILOX_W0, k1 + PHILOX_W1
+        hi0, lo0 = mulhilo(c0, m0)
+        hi1, lo1 = mulhilo(c2, m1)
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+    return c0, c1, c2, c3
+
+
+def philox4x64_words(counter, key0, key1, rounds=10):
+    """ first two words of the Philox4x64 block of counter (counter, 0, 0, 0) with Python integers """
+    c0, c1, c2, c3 = counter, 0, 0, 0
+    mask = (1 << 64) - 1
+    for i in range(rounds):
+        if i > 0:
+            key0, key1 = (key0 + 0x9E3779B97F4A7C15) & mask, (key1 + 0xBB67AE8584CAA73B) & mask
+        product0, product1 = PHILOX_M0 * c0, PHILOX_M1 * c2
+        c0, c1, c2, c3 = (product1 >> 64) ^ c1 ^ key0, product1 & mask, (product0 >> 64) ^ c3 ^ key1, product0 & mask
+    return c0, c1
+
+
+def to_uniform(raw):
+    """ doubles in [0, 1) from uint64, as Generator.random """
+    return (raw >> np.array(11, dtype=np.uint64)) * (1.0 / 9007199254740992.0)
+
+
+def occurrence_index(ids):
+    """ occurrence_index[i] is the number of j < i with ids[j] == ids[i] """
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    starts = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(ids.size), 0))
+    index = np.empty(ids.size, dtype=np.uint64)
+    index[order] = np.arange(ids.size) - group_start
+    return index
+
+
+def rewards_from_words(words, means, distribution, variance=1):
+    """ rewards from the first two words of the Philox blocks """
+    if distribution == "bernoulli":
+        return (to_uniform(words[0]) < means).astype(np.int64)
+    # Box-Muller on the first two words of the block
+    radius = np.sqrt(-2 * np.log1p(-to_uniform(words[0])))
+    return means + variance * radius * np.cos(2 * np.pi * to_uniform(words[1]))
+
+
+class RewardOracle:
+    small_batch = 48  # below this number of draws Python integers are faster than NumPy ufuncs
+    def __init__(self, means, seed=None, distribution="bernoulli", variance=1, buffer_size=None):
+        """
+        Rewards of every (player, arm) pair from one object.
+
+        The k-th reward of pair (player, arm) is computed from the Philox block with key (seed, pair id) and
+        counter k, so every pair has its own reproducible stream whatever the order and batching of the draws.
+
+        Args:
+        - means (array): The (num_players, num_arms) mean rewards, probabilities for Bernoulli rewards.
+        - seed (int, optional): A seed for the streams.
+        - distribution (str): "bernoulli" or "normal".
+        - variance (float): The scale of normal rewards, as in NormalDistribution.
+        - buffer_size (int, optional): Number of rewards pre-drawn at once for a pair, handed out by cursor.
+          The rewards do not depend on it.
+        """
+        if distribution not in ("bernoulli", "normal"):
+            raise ValueError(f"unknown reward distribution {distribution}")
+        self.means = np.asarray(means, dtype=float)
+        self.num_players, self.num_arms = self.means.shape
+        self.distribution = distribution
+        self.variance = variance
+        self.seed = seed
+        self.key = np.random.SeedSequence(seed).generate_state(1, dtype=np.uint64)[0]
+        self.draws = np.zeros(self.means.size, dtype=np.uint64)
+        self.buffer_size = buffer_size
+        # pair id -> [counter of the next reward, counter of the first buffered reward, rewards], filled on first use
+        self.buffers = {}
+
+    def sample(self, players, arms):
+        """
+        Draw one reward for each pair (players[i], arms[i]), a pair can appear several times.
+
+        Returns:
+        - array: The rewards, 0 / 1 integers for Bernoulli rewards.
+        """
+        players = np.asarray(players, dtype=np.int64)
+        arms = np.asarray(arms, dtype=np.int64)
+        if self.buffer_size is not None:
+            rewards = [self.sample_one(player, arm) for player, arm in zip(players.ravel().tolist(),
+                                                                             arms.ravel().tolist())]
+            return np.array(rewards, dtype=np.int64 if self.distribution == "bernoulli" else float).reshape(
+                players.shape)
+
+        pair_ids = (players * self.num_arms + arms).ravel()
+        counters = self.draws[pair_ids] + occurrence_index(pair_ids)
+        np.add.at(self.draws, pair_ids, np.uint64(1))
+        return self.draw(pair_ids, counters).reshape(players.shape)
+
+    def draw(self, pair_ids, counters):
+        """ rewards number counters[i] of the pairs pair_ids[i] """
+        if pair_ids.size < self.small_batch:
+            key = int(self.key)
+            blocks = [philox4x64_words(counter, key, pair_id)
+                      for counter, pair_id in zip(counters.tolist(), pair_ids.tolist())]
+            words = np.array(blocks, dtype=np.uint64).reshape(-1, 2).T
+        else:
+            zeros = np.zeros(pair_ids.size, dtype=np.uint64)
+            words = philox4x64(counter=(counters, zeros, zeros, zeros),
+                               key=(np.full(pair_ids.size, self.key), pair_ids.astype(np.uint64)))
+        return rewards_from_words(words, self.means.ravel()[pair_ids], self.distribution, self.variance)
+
+    def sample_one(self, player, arm):
+        pair_id = player * self.num_arms + arm
+        if self.buffer_size is None:
+            return self.sample([player], [arm])[0].item()
+
+        buffer = self.buffers.get(pair_id)
+        if buffer is None or buffer[0] - buffer[1] == len(buffer[2]):
+            buffer = self.refill(pair_id)
+        reward = buffer[2][buffer[0] - buffer[1]]
+        buffer[0] += 1
+        return reward
+
+    def refill(self, pair_id):
+        """ pre-draw the next buffer_size rewards of a pair, as bytes or an array of doubles """
+        buffer = self.buffers.get(pair_id)
+        counter = int(self.draws[pair_id]) if buffer is None else buffer[0]
+        rewards = self.draw(np.full(self.buffer_size, pair_id, dtype=np.uint64),
+                            counter + np.arange(self.buffer_size, dtype=np.uint64))
+        if self.distribution == "bernoulli":
+            rewards = rewards.astype(np.uint8).tobytes()
+        else:
+            rewards = array("d", rewards.tobytes())
+        self.buffers[pair_id] = [counter, counter, rewards]
+        return self.buffers[pair_id]
+
+    def draw_counts(self):
+        """ number of rewards drawn from every pair """
+        counts = self.draws.copy()
+        for pair_id, (counter, _, _) in self.buffers.items():
+            counts[pair_id] = counter
+        return counts
+
+    def reset(self):
+        """
+        Restart every stream to ensure reproducibility.
+        """
+        self.draws[:] = 0
+        self.buffers = {}
+
+    def get_state(self):
+        """ the streams are counter based, their state is the number of rewards drawn from every pair """
+        return {"draws": self.draw_counts()}
+
+    def set_state(self, state):
+        self.draws = np.array(state["draws"], dtype=np.uint64)
+        self.buffers = {}
+
+
+class ReplicatedRewardOracle:
+    def __init__(self, means, seeds, distribution="bernoulli", variance=1):
+        """
+        The reward streams of R independent replicates of one instance, replicate r draws exactly the rewards
+        of RewardOracle(means, seeds[r]).
+
+        Args:
+        - means (array): The (num_players, num_arms) mean rewards, probabilities for Bernoulli rewards.
+        - seeds (list): One seed per replicate.
+        - distribution (str): "bernoulli" or "normal".
+        - variance (float): The scale of normal rewards.
+        """
+        if distribution not in ("bernoulli", "normal"):
+            raise ValueError(f"unknown reward distribution {distribution}")
+        self.means = np.asarray(means, dtype=float)
+        self.num_players, self.num_arms = self.means.shape
+        self.distribution = distribution
+        self.variance = variance
+        self.seeds = list(seeds)
+        self.keys = np.array([np.random.SeedSequence(seed).generate_state(1, dtype=np.uint64)[0]
+                              for seed in self.seeds], dtype=np.uint64)
+        self.draws = np.zeros((len(self.seeds), self.means.size), dtype=np.uint64)
+
+    def sample(self, replicates, players, arms):
+        """
+        Draw one reward for each (replicates[i], players[i], arms[i]), a triple can appear several times.
+
+        Returns:
+        - array: The rewards, 0 / 1 integers for Bernoulli rewards.
+        """
+        replicates = np.asarray(replicates, dtype=np.int64).ravel()
+        pair_ids = (np.asarray(players, dtype=np.int64) * self.num_arms + np.asarray(arms, dtype=np.int64)).ravel()
+        stream_ids = replicates * self.means.size + pair_ids
+        counters = self.draws.ravel()[stream_ids] + occurrence_index(stream_ids)
+        np.add.at(self.draws.reshape(-1), stream_ids, np.uint64(1))
+        zeros = np.zeros(pair_ids.size, dtype=np.uint64)
+        words = philox4x64(counter=(counters, zeros, zeros, zeros),
+                           key=(self.keys[replicates], pair_ids.astype(np.uint64)))
+        return rewards_from_words(words, self.means.ravel()[pair_ids], self.distribution, self.variance)
+
+    def reset(self):
+        self.draws[:] = 0
@@ -0,0 +1,101 @@
+import numpy as np
+
+from matching.distributions.reward_oracle import RewardOracle, ReplicatedRewardOracle, philox4x64, \
+    philox4x64_words
+
+
+def random_words(rng, size):
+    return rng.integers(0, 2 ** 64, size, dtype=np.uint64)
+
+
+def test_philox4x64():
+    """
+    the Philox4x64-10 blocks (NumPy and Python integers) are the ones of np.random.Philox, which increments its
+    counter before the first block
+    """
+    rng = np.random.default_rng(0)
+    size = 100
+    counters = [rng.integers(1, 2 ** 64, size, dtype=np.uint64)] + [random_words(rng, size) for _ in range(3)]
+    keys = [random_words(rng, size), random_words(rng, size)]
+    blocks = np.array(philox4x64(counters, keys))
+    # uint64 arrays, Philox converts lists of Python integers above 2 ** 63 with a loss
+    previous_counters = np.array(counters).T - np.array([1, 0, 0, 0], dtype=np.uint64)
+    keys_array = np.array(keys).T
+    for i in range(size):
+        bit_generator = np.random.Philox(counter=previous_counters[i], key=keys_array[i])
+        assert np.array_equal(blocks[:, i], bit_generator.random_raw(4))
+        # the Python integer path on counters (counter, 0, 0, 0)
+        bit_generator = np.random.Philox(counter=previous_counters[i] * np.array([1, 0, 0, 0], dtype=np.uint64),
+                                         key=keys_array[i])
+        assert list(philox4x64_words(int(counters[0][i]), int(keys[0][i]), int(keys[1][i]))) == \
+            bit_generator.random_raw(4)[:2].tolist()
+    print("End")
+
+
+def test_reward_oracle_streams():
+    """
+    the k-th reward of a pair does not depend on the draws of the other pairs nor on the batching: the rewards
+    drawn in random batches (small ones on the Python integer path) are the ones of every pair drawn alone, and
+    the replicated oracle draws the rewards of the oracle of each seed
+    """
+    rng = np.random.default_rng(1)
+    num_players_test, num_arms = 3, 4
+    for distribution in ["bernoulli", "normal"]:
+        means = rng.random((num_players_test, num_arms))
+        oracle = RewardOracle(means, seed=5, distribution=distribution)
+        streams = {}
+        for _ in range(30):
+            size = rng.integers(1, 3 * RewardOracle.small_batch)
+            players, arms = rng.integers(0, num_players_test, size), rng.integers(0, num_arms, size)
+            for player, arm, reward in zip(players, arms, oracle.sample(players, arms)):
+                streams.setdefault((player, arm), []).append(reward)
+        for (player, arm), rewards in streams.items():
+            alone = RewardOracle(means, seed=5, distribution=distribution)
+            assert np.array_equal(alone.sample(np.full(len(rewards), player), np.full(len(rewards), arm)), rewards)
+            assert oracle.draw_counts()[player * num_arms + arm] == len(rewards)
+
+        seeds = [5, 6, 7]
+        replicated = ReplicatedRewardOracle(means, seeds, distribution=distribution)
+        oracles = [RewardOracle(means, seed=seed, distribution=distribution) for seed in seeds]
+        for _ in range(10):
+            size = rng.integers(1, 100)
+            replicates = rng.integers(0, len(seeds), size)
+            players, arms = rng.integers(0, num_players_test, size), rng.integers(0, num_arms, size)
+            rewards = replicated.sample(replicates, players, arms)
+            for replicate in range(len(seeds)):
+                rows = replicates == replicate
+                assert np.array_equal(rewards[rows], oracles[replicate].sample(players[rows], arms[rows]))
+    print("End")
+
+
+def test_reward_oracle_buffers():
+    """
+    the rewards handed out from the per-pair buffers, refilled several times and restored from a state in the
+    middle of a buffer, are the unbuffered ones
+    """
+    rng = np.random.default_rng(2)
+    num_players_test, num_arms = 3, 3
+    for distribution in ["bernoulli", "normal"]:
+        means = rng.random((num_players_test, num_arms))
+        buffered = RewardOracle(means, seed=9, distribution=distribution, buffer_size=7)
+        unbuffered = RewardOracle(means, seed=9, distribution=distribution)
+        for step in range(60):
+            if step % 2:
+                player, arm = rng.integers(num_players_test), rng.integers(num_arms)
+                assert buffered.sample_one(player, arm) == unbuffered.sample_one(player, arm)
+            else:
+                size = rng.integers(1, 20)
+                players, arms = rng.integers(0, num_players_test, size), rng.integers(0, num_arms, size)
+                assert np.array_equal(buffered.sample(players, arms), unbuffered.sample(players, arms))
+            assert np.array_equal(buffered.draw_counts(), unbuffered.draw_counts())
+            if step == 30:
+                restored = RewardOracle(means, seed=9, distribution=distribution, buffer_size=7)
+                restored.set_state(buffered.get_state())
+                buffered = restored
+    print("End")
+
+
+if __name__ == "__main__":
+    test_philox4x64()
+    test_reward_oracle_streams()
+    test_reward_oracle_buffers()
@@ -2,172 +2,196 @@
 # https://link.springer.com/content/pdf/10.1007/BF00998632.pdf
 # recoloring path using augmenting path
 import itertools
-from collections import defaultdict
 import numpy as np
 
 
-def fixed_matching(matching, num_players):
-    fixed_matching = []
-    for (player, arm) in matching:
-        fixed_matching += [(player, arm - num_players)]
-    return fixed_matching
-
-
-def transform_to_complete_matching(matching, num_players):
-    # All agents on both sides
-    left_agents = set(range(num_players))
-    right_agents = set(range(num_players, 2 * num_players))
-
-    # Extract matched agents from the current matching
-    matched_left = set(a for a, _ in matching)
-    matched_right = set(b for _, b in matching)
-
-    # Find unmatched agents
-    unmatched_left = list(left_agents - matched_left)
-    unmatched_right = list(right_agents - matched_right)
-
-    # Create a complete matching
-    complete_m = matching.copy()  # Copy existing matching
-    for a, b in zip(unmatched_left, unmatched_right):
-        complete_m.append((a, b))
-
-    return complete_m
-
-
-def matching_from_edge_colors(num_players, edge_colors, possible_colors):
-    matchings = {c: [] for c in possible_colors}
-    for i in range(num_players):
-        for j in range(num_players):
-            if (i, j + num_players) in edge_colors:
-                c = edge_colors[i, j + num_players]
-                matchings[c] += [(i, j + num_players)]
-    return matchings
-
+def lowest_color(colors):
+    """ smallest colour of a bit set of colours """
+    return (colors & -colors).bit_length() - 1
+
+
+def max_degree_of(adjacency_matrix):
+    if adjacency_matrix.size == 0:
+        return 0
+    return int(max(adjacency_matrix.sum(axis=1).max(), adjacency_matrix.sum(axis=0).max()))
+
+
+def edge_coloring(adjacency_matrix, max_degree=None):
+    """
+    König edge colouring of the bipartite graph with max_degree colours, vertex p < N is player p and N + a is arm a.
+
+    The colouring is kept in a dense (2N, max_degree) table, color_at[v, c] is the vertex joined to v by the edge of
+    colour c or -1 when c is missing at v, and the free colours of a vertex are a bit set. Edges are coloured in
+    row-major order with the smallest colour missing at both ends, otherwise with a, missing at the player, after
+    swapping a and b, missing at the arm, along the alternating path that starts at the arm.
+    """
+    adjacency_matrix = np.asarray(adjacency_matrix)
+    num_players = adjacency_matrix.shape[0]
+    if max_degree is None:
+        max_degree = max_degree_of(adjacency_matrix)
+    if max_degree == num_players and adjacency_matrix.all():
+        # complete graph, the cyclic latin square matches player p with arm p + c in colour c
+        colors = np.arange(num_players)
+        return np.concatenate([num_players + (colors[:, None] + colors[None, :]) % num_players,
+                               (colors[:, None] - colors[None, :]) % num_players])
+
+    color_at = np.full((2 * num_players, max_degree), -1, dtype=np.int64)
+    players, arms = np.nonzero(adjacency_matrix)
+    return color_edges(color_at, players, arms + num_players)
+
+
+def free_colors_of(color_at):
+    """ free colours of every vertex as a bit set """
+    bits = np.packbits(color_at < 0, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in bits]
+
+
+def color_edges(color_at, players, arms):
+    """
+    colour the edges (players[i], arms[i]) of a partial colouring in order, arms are vertices N + a.
+    Each end of a new edge needs a free colour, which holds while the degrees stay within the number of colours.
+    """
+    max_degree = color_at.shape[1]
+    free = free_colors_of(color_at)
+    # flat view of the table, color_at[v * max_degree + c]
+    color_at = color_at.ravel().tolist()
+    for u, w in zip(np.asarray(players).tolist(), np.asarray(arms).tolist()):
+        common = free[u] & free[w]
+        if common:
+            color = lowest_color(common)
+        else:
+            a = lowest_color(free[u])
+            b = lowest_color(free[w])
+            # a is used at w, follow the a / b path from w and swap its colours
+            path = []
+            v1, c = w, a
+            while color_at[v1 * max_degree + c] != -1:
+                v2 = color_at[v1 * max_degree + c]
+                path.append((v1, v2, c))
+                v1, c = v2, a + b - c
+            for v1, v2, c in path:
+                color_at[v1 * max_degree + c] = -1
+                color_at[v2 * max_degree + c] = -1
+            for v1, v2, c in path:
+                color_at[v1 * max_degree + a + b - c] = v2
+                color_at[v2 * max_degree + a + b - c] = v1
+            # only the ends of the path change their free colours
+            swap = (1 << a) | (1 << b)
+            free[w] ^= swap
+            free[path[-1][1]] ^= swap
+            color = a
+        color_at[u * max_degree + color] = w
+        color_at[w * max_degree + color] = u
+        free[u] &= ~(1 << color)
+        free[w] &= ~(1 << color)
+    return np.array(color_at, dtype=np.int64).reshape(len(free), max_degree)
+
+
+def repair_coloring(color_at, adjacency_matrix, max_degree=None):
+    """
+    colouring of adjacency_matrix obtained from the colouring color_at of a previous graph: the edges that left
+    the graph are uncoloured, the edges of the colours above the new max degree and the new edges are coloured
+    again, every other edge keeps its colour
+    """
+    adjacency_matrix = np.asarray(adjacency_matrix) != 0
+    num_players = adjacency_matrix.shape[0]
+    if max_degree is None:
+        max_degree = max_degree_of(adjacency_matrix)
+
+    color_at = color_at.copy()
+    players, colors = np.nonzero(color_at[:num_players] >= 0)
+    arms = color_at[players, colors] - num_players
+    removed = ~adjacency_matrix[players, arms]
+    color_at[players[removed], colors[removed]] = -1
+    color_at[num_players + arms[removed], colors[removed]] = -1
+
+    if max_degree <= color_at.shape[1]:
+        # both ends of an edge hold it in the same column, so dropping the columns uncolours these edges
+        color_at = color_at[:, :max_degree]
+    else:
+        color_at = np.concatenate([color_at, np.full((2 * num_players, max_degree - color_at.shape[1]), -1)], axis=1)
+
+    colored = np.zeros_like(adjacency_matrix)
+    players, colors = np.nonzero(color_at[:num_players] >= 0)
+    colored[players, color_at[players, colors] - num_players] = True
+    players, arms = np.nonzero(adjacency_matrix & ~colored)
+    return color_edges(np.ascontiguousarray(color_at), players, arms + num_players)
+
+
+def matchings_from_coloring(color_at, num_players, complete=False):
+    """
+    (max_degree, N, 2) array of the colour classes, matchings[c, p] = (p, arm of p in colour c) and -1 for the
+    unmatched players. If complete the unmatched players are paired in increasing order with the unmatched arms.
+    """
+    partner = color_at[:num_players].T
+    arms = np.where(partner >= 0, partner - num_players, -1)
+    if complete and arms.size:
+        matched = arms >= 0
+        colors, players = np.nonzero(matched)
+        used_arms = np.zeros_like(matched)
+        used_arms[colors, arms[colors, players]] = True
+        # unmatched players / arms first and in increasing order
+        player_order = np.argsort(matched, axis=1, kind="stable")
+        arm_order = np.argsort(used_arms, axis=1, kind="stable")
+        fill = np.arange(num_players)[None, :] < (~matched).sum(axis=1)[:, None]
+        colors = np.nonzero(fill)[0]
+        arms[colors, player_order[fill]] = arm_order[fill]
+    players = np.broadcast_to(np.arange(num_players), arms.shape)
+    return np.stack([players, arms], axis=-1)
 
-def recoloring(edge_colors, vertex_colors, augmenting_path, color_a, color_b):
-    """ fix this remove add color"""
-    i = 0
-    for (v1, v2) in augmenting_path:
-        vertex_colors[v1].discard(color_a)
-        vertex_colors[v2].discard(color_a)
-        vertex_colors[v1].discard(color_b)
-        vertex_colors[v2].discard(color_b)
 
-    for (v1, v2) in augmenting_path:
-        if i % 2 == 0:
-            c1 = color_b
-        else:
-            c1 = color_a
-        edge_colors[(v1, v2)] = c1
-        edge_colors[(v2, v1)] = c1
-        vertex_colors[v1].add(c1)
-        vertex_colors[v2].add(c1)
-        i += 1
-    return edge_colors, vertex_colors
-
-
-def find_augmenting_path(v1, a, b, adjacency_list, edge_colors):
-    augmenting_path = []
-    i = 0
-    flag = True
-    while flag:
-        i += 1
-        if i % 2 == 0:
-            c = b
+def get_matchings_edge_coloring(num_players, adjacency_matrix, complete=False):
+    """
+    colour classes of a minimum edge colouring of the availability graph as a (max_degree, N, 2) array,
+    arms are -1 for unmatched players unless complete
+    """
+    adjacency_matrix = np.asarray(adjacency_matrix)
+    color_at = edge_coloring(adjacency_matrix)
+    return matchings_from_coloring(color_at, num_players, complete=complete)
+
+
+class IncrementalEdgeColoring(object):
+    """
+    Edge colouring of an availability graph that changes a little between calls.
+
+    The colouring of the previous graph is kept: the same graph returns the cached matchings, a changed graph
+    repairs the previous colouring instead of colouring from scratch.
+    """
+
+    def __init__(self, num_players, complete=False):
+        self.num_players = num_players
+        self.complete = complete
+        self.adjacency_matrix = None
+        self.color_at = None
+        self.matchings = None
+
+    def update(self, adjacency_matrix):
+        adjacency_matrix = np.asarray(adjacency_matrix) != 0
+        if self.adjacency_matrix is not None and np.array_equal(adjacency_matrix, self.adjacency_matrix):
+            return self.matchings
+        if self.color_at is None:
+            self.color_at = edge_coloring(adjacency_matrix)
         else:
-            c = a
-        flag = False
-        for v2 in adjacency_list[v1]:
-            if (v1, v2) in edge_colors:
-                if edge_colors[(v1, v2)] == c:
-                    augmenting_path += [(v1, v2)]
-                    v1 = v2
-                    flag = True
-                    break
-                else:
-                    flag = False
-    return augmenting_path
-
-
-def edge_coloring(num_players, adjacency_list, max_degree):
-    possible_colors = set(range(max_degree))
-    # Dictionary to store the color of each edge
-    edge_colors = {}
-
-    # Dictionary to store used colors for each vertex
-    vertex_colors = defaultdict(set)
-
-    # Step 1: Iterate over each edge in the bipartite graph
-    for u in range(num_players):
-        for w in adjacency_list[u]:
-            if (u, w) not in edge_colors:
-                # Step 2: Find the smallest available color for the edge (u, v)
-                a = possible_colors.difference(vertex_colors[u])
-                b = possible_colors.difference(vertex_colors[w])
-
-                available_colors = a.intersection(b)
-                if len(available_colors) >= 1:  # if available color
-                    # Find the smallest color that is not used by adjacent edges
-                    color = min(available_colors)
-
-                    # Step 3: Assign the color to the edge (u, v)
-                    edge_colors[(u, w)] = color
-                    edge_colors[(w, u)] = color
-                    vertex_colors[u].add(color)
-                    vertex_colors[w].add(color)
-                else:  # if not available color we need to recolor by contrating augemneting path
-                    a = min(a)
-                    b = min(b)
-                    aug_path = find_augmenting_path(v1=w,
-                                                    a=a,
-                                                    b=b,
-                                                    adjacency_list=adjacency_list,
-                                                    edge_colors=edge_colors)
-                    edge_colors, vertex_colors = recoloring(edge_colors=edge_colors, vertex_colors=vertex_colors,
-                                                            augmenting_path=aug_path, color_a=a, color_b=b)
-                    edge_colors[(u, w)] = a
-                    edge_colors[(w, u)] = a
-                    vertex_colors[u].add(a)
-                    vertex_colors[w].add(a)
-    matchings = matching_from_edge_colors(num_players, edge_colors, possible_colors)
-    return matchings
+            self.color_at = repair_coloring(self.color_at, adjacency_matrix)
+        self.adjacency_matrix = adjacency_matrix
+        self.matchings = matchings_from_coloring(self.color_at, self.num_players, complete=self.complete)
+        return self.matchings
 
+    def get_state(self):
+        if self.color_at is None:
+            return {}
+        return {"adjacency_matrix": self.adjacency_matrix, "color_at": self.color_at}
 
-def get_matchings_edge_coloring(num_players, adjacency_matrix, complete=False):
-    #  1. find degree
-    degree_players = max(adjacency_matrix.sum(axis=1))
-    degree_arms = max(adjacency_matrix.sum(axis=0))
-    max_degree = int(max(degree_players, degree_arms))
-
-    #  2. create adjacency_list
-    adjacency_list = defaultdict(list)
-
-    for u in range(num_players):
-        for v in range(num_players):
-            if adjacency_matrix[u][v] == 1:
-                adjacency_list[u] += [v + num_players]
-                adjacency_list[v + num_players] += [u]
-
-    tmp_matchings = edge_coloring(num_players=num_players, adjacency_list=adjacency_list, max_degree=max_degree)
-    if complete:
-        # if complete we return a complete matching pairing arbitrary the agents
-        matchings = []
-        for matching_id in tmp_matchings:
-            complete_matching = transform_to_complete_matching(matching=tmp_matchings[matching_id],
-                                                               num_players=num_players)
-            fixed_complete_matching = fixed_matching(complete_matching, num_players)
-            assert len(fixed_complete_matching) == num_players
-            matchings += [np.array(fixed_complete_matching)]
-    else:
-        matchings = []
-        for matching_id in tmp_matchings:
-            fixed_tmp_matching = fixed_matching(matching=tmp_matchings[matching_id], num_players=num_players)
-            matchings += [np.array(fixed_tmp_matching)]
-    return matchings
+    def set_state(self, state):
+        if "color_at" not in state:
+            self.adjacency_matrix = self.color_at = self.matchings = None
+            return
+        self.adjacency_matrix = np.array(state["adjacency_matrix"], dtype=bool)
+        self.color_at = np.array(state["color_at"])
+        self.matchings = matchings_from_coloring(self.color_at, self.num_players, complete=self.complete)
 
 
 if __name__ == '__main__':
-    import numpy as np
     import time
 
     MATRIX = 1 - np.array([[0, 0, 0, 0, 0],
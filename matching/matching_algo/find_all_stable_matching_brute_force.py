@@ -1,11 +1,66 @@
-from matching.matching_algo.find_all_matchings import find_all_matchings
-from matching.matching_algo.is_stable import is_stable
+import multiprocessing
 
+from matching.utils import preferences_to_ranks
 
-def all_stable_matching_brute_force(players_ranking, arms_rankings, num_players):
-    matchings = find_all_matchings(num_of_players=num_players)
+
+def iter_stable_matchings_backtracking(players_ranking, arms_rankings, num_players, first_arm=None):
+    """
+    generate the stable matchings (player -> arm tuples) in lexicographic order.
+
+    Players are assigned one at a time to a free arm and a partial matching is pruned as soon as two of its pairs
+    form a blocking pair, every blocking pair of a complete matching involves two of its pairs so the complete
+    matchings that survive are stable. Only the current partial matching is kept in memory.
+    first_arm fixes the arm of player 0, which shards the search space.
+    """
+    player_ranks = preferences_to_ranks(players_ranking).tolist()
+    arm_ranks = preferences_to_ranks(arms_rankings).tolist()
+    matching = [-1] * num_players
+    used = [False] * num_players
+
+    def compatible(player, arm):
+        for other, other_arm in enumerate(matching[:player]):
+            # (player, other_arm) blocks
+            if player_ranks[player][other_arm] < player_ranks[player][arm] and \
+                    arm_ranks[other_arm][player] < arm_ranks[other_arm][other]:
+                return False
+            # (other, arm) blocks
+            if player_ranks[other][arm] < player_ranks[other][other_arm] and \
+                    arm_ranks[arm][other] < arm_ranks[arm][player]:
+                return False
+        return True
+
+    def assign(player):
+        if player == num_players:
+            yield tuple(matching)
+            return
+        arms = range(num_players) if player > 0 or first_arm is None else [first_arm]
+        for arm in arms:
+            if not used[arm] and compatible(player, arm):
+                matching[player] = arm
+                used[arm] = True
+                yield from assign(player + 1)
+                used[arm] = False
+                matching[player] = -1
+
+    yield from assign(0)
+
+
+def _stable_matchings_shard(args):
+    players_ranking, arms_rankings, num_players, first_arm = args
+    return list(iter_stable_matchings_backtracking(players_ranking, arms_rankings, num_players, first_arm))
+
+
+def all_stable_matching_brute_force(players_ranking, arms_rankings, num_players, processes=1):
+    """
+    all stable matchings by exhaustive search, with processes > 1 the search is sharded by the arm of player 0
+    over a process pool
+    """
+    if processes <= 1 or num_players <= 1:
+        return list(iter_stable_matchings_backtracking(players_ranking, arms_rankings, num_players))
+
+    shards = [(players_ranking, arms_rankings, num_players, first_arm) for first_arm in range(num_players)]
     list_of_stable_matchings = []
-    for matching in matchings:
-        if is_stable(matching, arms_rankings, players_ranking, num_players):
-            list_of_stable_matchings += [matching]
-    return list_of_stable_matchings
\ No newline at end of file
+    with multiprocessing.Pool(processes=processes) as pool:
+        for shard_matchings in pool.imap(_stable_matchings_shard, shards):
+            list_of_stable_matchings += shard_matchings
+    return list_of_stable_matchings
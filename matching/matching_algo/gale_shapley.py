@@ -1,26 +1,120 @@
 import numpy as np
 
-from matching.utils import inv_matching
+from matching.utils import preferences_to_ranks
+
+
+def gale_shapley_ranks(proposer_preferences, receiver_ranks):
+    """
+    Deferred acceptance on integer rank arrays.
+
+    proposer_preferences[i] is the preference list of proposer i and receiver_ranks[j, i] is the position of
+    proposer i in the preference list of receiver j. Free proposers are kept in a stack and every proposer
+    proposes at most once to every receiver, so the worst case is O(n^2) with O(1) work per proposal.
+
+    returns the proposer-optimal matching from both sides:
+    - proposer_match[i] the receiver matched to proposer i
+    - receiver_match[j] the proposer matched to receiver j
+    """
+    if isinstance(proposer_preferences, np.ndarray):
+        proposer_preferences = proposer_preferences.tolist()
+    if isinstance(receiver_ranks, np.ndarray):
+        receiver_ranks = receiver_ranks.tolist()
+
+    num_proposers = len(proposer_preferences)
+    next_proposal = [0] * num_proposers
+    proposer_match = [-1] * num_proposers
+    receiver_match = [-1] * len(receiver_ranks)
+    free_proposers = list(range(num_proposers - 1, -1, -1))
+
+    while free_proposers:
+        proposer = free_proposers.pop()
+        receiver = proposer_preferences[proposer][next_proposal[proposer]]
+        next_proposal[proposer] += 1
+
+        holder = receiver_match[receiver]
+        if holder == -1:
+            receiver_match[receiver] = proposer
+            proposer_match[proposer] = receiver
+        elif receiver_ranks[receiver][proposer] < receiver_ranks[receiver][holder]:
+            receiver_match[receiver] = proposer
+            proposer_match[proposer] = receiver
+            proposer_match[holder] = -1
+            free_proposers.append(holder)
+        else:
+            free_proposers.append(proposer)
+
+    return np.array(proposer_match, dtype=np.int64), np.array(receiver_match, dtype=np.int64)
+
+
+def batched_gale_shapley(proposer_preferences, receiver_ranks):
+    """
+    Deferred acceptance over a stack of B profiles, proposer_preferences and receiver_ranks are (B, N, N).
+
+    Proposals are resolved round-synchronously: in every round all free proposers of all profiles propose to
+    their next receiver and every receiver keeps the best among its current holder and its new proposals.
+
+    returns (proposer_match, receiver_match) as (B, N) arrays
+    """
+    proposer_preferences = np.asarray(proposer_preferences, dtype=np.int64)
+    receiver_ranks = np.asarray(receiver_ranks, dtype=np.int64)
+    num_profiles, num_proposers, _ = proposer_preferences.shape
+    num_receivers = receiver_ranks.shape[1]
+
+    next_proposal = np.zeros((num_profiles, num_proposers), dtype=np.int64)
+    proposer_match = np.full((num_profiles, num_proposers), -1, dtype=np.int64)
+    receiver_match = np.full((num_profiles, num_receivers), -1, dtype=np.int64)
+    # best rank seen by every (profile, receiver) in the current round, indexed by profile * N + receiver
+    best_rank = np.empty(num_profiles * num_receivers, dtype=np.int64)
+
+    free_b, free_p = np.nonzero(proposer_match == -1)
+    while free_b.size:
+        targets = proposer_preferences[free_b, free_p, next_proposal[free_b, free_p]]
+        next_proposal[free_b, free_p] += 1
+
+        # every receiver keeps the best among its holder (rank num_proposers if it has none) and its proposals
+        holders = receiver_match[free_b, targets]
+        holder_rank = np.where(holders >= 0, receiver_ranks[free_b, targets, np.maximum(holders, 0)], num_proposers)
+        proposal_rank = receiver_ranks[free_b, targets, free_p]
+        keys = free_b * num_receivers + targets
+        best_rank[keys] = holder_rank
+        np.minimum.at(best_rank, keys, proposal_rank)
+
+        # ranks are unique, so at most one proposal per receiver is accepted
+        accepted = proposal_rank == best_rank[keys]
+        acc_b, acc_r, acc_p = free_b[accepted], targets[accepted], free_p[accepted]
+        displaced = holders[accepted]
+        has_holder = displaced >= 0
+        proposer_match[acc_b[has_holder], displaced[has_holder]] = -1
+        receiver_match[acc_b, acc_r] = acc_p
+        proposer_match[acc_b, acc_p] = acc_r
+
+        # rejected proposers and displaced holders propose again in the next round
+        free_b = np.concatenate((free_b[~accepted], acc_b[has_holder]))
+        free_p = np.concatenate((free_p[~accepted], displaced[has_holder]))
+
+    return proposer_match, receiver_match
+
+
+def stable_match(player_preferences, arm_preferences, mode=0, player_ranks=None, arm_ranks=None):
+    """
+    player -> arm stable matching, mode 0 for the player optimal (players propose) and
+    mode 1 for the player pessimal (arms propose). Precomputed rank matrices can be passed to avoid
+    recomputing them.
+    """
+    if mode == 0:
+        if arm_ranks is None:
+            arm_ranks = preferences_to_ranks(arm_preferences)
+        player_match, _ = gale_shapley_ranks(player_preferences, arm_ranks)
+    else:
+        if player_ranks is None:
+            player_ranks = preferences_to_ranks(player_preferences)
+        _, player_match = gale_shapley_ranks(arm_preferences, player_ranks)
+    return player_match
+
 
 def gale_shapley_algo(arms_rankings, player_ranking, num_players, num_arms):
-    matched = np.zeros(num_players, bool)
-    proposal_order = np.zeros(num_players, int)
-    arm_matching = [[] for _ in range(num_arms)]
-
-    i = 0
-    while np.sum(matched) != num_arms:
-        for player in range(num_players):
-            if not matched[player]:
-                player_proposal = player_ranking[player][proposal_order[player]]
-                proposal_order[player] += 1
-
-                if arm_matching[player_proposal] == []:
-                    arm_matching[player_proposal] = player
-                    matched[player] = True
-                elif arms_rankings[player_proposal].index(arm_matching[player_proposal]) > arms_rankings[
-                    player_proposal].index(player):
-                    matched[arm_matching[player_proposal]] = False
-                    matched[player] = True
-                    arm_matching[player_proposal] = player
-        i += 1
-    return inv_matching(arm_matching)
\ No newline at end of file
+    """
+    player optimal matching, player_ranking proposes to arms_rankings
+    """
+    assert num_players == num_arms, "complete preferences with the same number of players and arms are expected"
+    return stable_match(player_ranking, arms_rankings, mode=0)
@@ -0,0 +1,113 @@
+"""
+Warm-started Gale Shapley for slowly changing player preferences.
+"""
+import numpy as np
+
+from matching.utils import preferences_to_ranks
+
+
+class IncrementalGaleShapley(object):
+    """
+    Player proposing deferred acceptance that keeps its proposal pointers, tentative engagements and a log
+    of the proposals it made.
+
+    When the preferences of some players change, only the proposals made from the first proposal that is no
+    longer valid are undone. The remaining log is a valid execution of deferred acceptance under the new
+    preferences, so continuing the proposals from there returns the new player optimal matching.
+    """
+
+    def __init__(self, player_preferences, arm_preferences=None, arm_ranks=None):
+        if arm_ranks is None:
+            arm_ranks = preferences_to_ranks(arm_preferences)
+        self.arm_ranks = np.asarray(arm_ranks).tolist()
+        self.player_preferences = np.array(player_preferences, dtype=np.int64)
+        self.num_players = self.player_preferences.shape[0]
+        self.preference_lists = self.player_preferences.tolist()
+
+        # state of the deferred acceptance
+        self.next_proposal = [0] * self.num_players
+        self.player_match = [-1] * self.num_players
+        self.arm_match = [-1] * self.num_players
+        self.free_players = set(range(self.num_players))
+
+        # proposal_log[t] = (player, arm, previous holder of arm, accepted)
+        self.proposal_log = []
+        # proposal_time[p][k] is the position in the log of the k-th proposal of player p
+        self.proposal_time = [[0] * self.num_players for _ in range(self.num_players)]
+        self.propose()
+
+    def propose(self):
+        """
+        run deferred acceptance from the current state until every player is matched
+        """
+        preference_lists = self.preference_lists
+        arm_ranks = self.arm_ranks
+        next_proposal = self.next_proposal
+        player_match = self.player_match
+        arm_match = self.arm_match
+        free_players = self.free_players
+        proposal_log = self.proposal_log
+        proposal_time = self.proposal_time
+
+        while free_players:
+            player = free_players.pop()
+            arm = preference_lists[player][next_proposal[player]]
+            proposal_time[player][next_proposal[player]] = len(proposal_log)
+            next_proposal[player] += 1
+
+            holder = arm_match[arm]
+            accepted = holder == -1 or arm_ranks[arm][player] < arm_ranks[arm][holder]
+            if accepted:
+                arm_match[arm] = player
+                player_match[player] = arm
+                if holder != -1:
+                    player_match[holder] = -1
+                    free_players.add(holder)
+            else:
+                free_players.add(player)
+            proposal_log.append((player, arm, holder, accepted))
+
+    def rewind(self, time):
+        """
+        undo the proposals made from position time of the log onwards
+        """
+        while len(self.proposal_log) > time:
+            player, arm, holder, accepted = self.proposal_log.pop()
+            self.next_proposal[player] -= 1
+            if accepted:
+                self.arm_match[arm] = holder
+                self.player_match[player] = -1
+                self.free_players.add(player)
+                if holder != -1:
+                    self.player_match[holder] = arm
+                    self.free_players.discard(holder)
+
+    def update(self, player_preferences, changed_players=None):
+        """
+        warm-started player optimal matching for the new player preferences
+
+        changed_players are the players whose preference order may have changed, when None they are detected
+        by comparing with the previous preferences.
+        """
+        player_preferences = np.asarray(player_preferences, dtype=np.int64)
+        if changed_players is None:
+            changed_players = np.nonzero((player_preferences != self.player_preferences).any(axis=1))[0]
+
+        rewind_time = len(self.proposal_log)
+        for player in changed_players:
+            difference = np.nonzero(player_preferences[player] != self.player_preferences[player])[0]
+            if difference.size == 0:
+                continue
+            # the proposals of the player are valid up to the first position where the orders differ
+            first_difference = difference[0]
+            if first_difference < self.next_proposal[player]:
+                rewind_time = min(rewind_time, self.proposal_time[player][first_difference])
+            self.player_preferences[player] = player_preferences[player]
+            self.preference_lists[player] = player_preferences[player].tolist()
+
+        self.rewind(rewind_time)
+        self.propose()
+        return self.get_match()
+
+    def get_match(self):
+        return np.array(self.player_match, dtype=np.int64)
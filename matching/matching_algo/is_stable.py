@@ -7,6 +7,42 @@ def is_stable(arm_matching, players_ranking, arms_rankings, num_players):
     return not is_unstable(arm_matching, players_ranking, arms_rankings, num_players)
 
 
+def batch_is_stable(matchings, player_ranks, arm_ranks, return_blocking_pairs=False):
+    """
+    Stability check of a batch of player -> arm matchings in one NumPy pass.
+
+    matchings is (B, N) with matchings[b, p] the arm of player p, player_ranks[p, a] is the position of arm a in
+    the preference list of player p and arm_ranks[a, p] the position of player p in the list of arm a.
+    A matching that is not a permutation (e.g. -1 for unmatched agents) is unstable.
+
+    returns the (B,) stable flags and, if return_blocking_pairs, the (B, N, N) mask of blocking pairs where
+    blocking[b, p, a] is True if (p, a) blocks matching b
+    """
+    player_ranks = np.asarray(player_ranks)
+    arm_ranks = np.asarray(arm_ranks)
+    matchings = np.atleast_2d(np.asarray(matchings, dtype=np.int64))
+    num_matchings, num_players = matchings.shape
+    players = np.arange(num_players)
+
+    # matchings that are not permutations are replaced by the identity to keep the indexing valid
+    valid = (np.sort(matchings, axis=1) == players).all(axis=1)
+    matchings = np.where(valid[:, None], matchings, players)
+    arm_matchings = np.empty_like(matchings)
+    arm_matchings[np.arange(num_matchings)[:, None], matchings] = players
+
+    # rank of the current partner of every player and every arm
+    player_partner_rank = player_ranks[players, matchings]
+    arm_partner_rank = arm_ranks[players, arm_matchings]
+
+    # (p, a) blocks if p prefers a to its partner and a prefers p to its partner
+    blocking = (player_ranks[None, :, :] < player_partner_rank[:, :, None]) & \
+               (arm_ranks.T[None, :, :] < arm_partner_rank[:, None, :])
+    stable = valid & ~blocking.any(axis=(1, 2))
+    if return_blocking_pairs:
+        return stable, blocking
+    return stable
+
+
 def is_unstable(arm_matching, players_ranking, arms_rankings, num_players):
     # if arm unmatched -> unstable
     if -1 in arm_matching:
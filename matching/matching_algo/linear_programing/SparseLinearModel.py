@@ -0,0 +1,238 @@
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog, milp, LinearConstraint, Bounds
+
+from matching.matching_algo.gale_shapley import stable_match
+from matching.utils import get_rank_function
+
+try:
+    import highspy
+except ImportError:  # without highspy every solve rebuilds the model through scipy
+    highspy = None
+
+
+class SparseLinearModel(object):
+    """
+    Stable matching linear model assembled as a SciPy sparse matrix and solved in-process with HiGHS.
+
+    Variable p * N + w is the allocation of worker w to player p, extra variables (e.g. the absolute value of the
+    sex-equal model) follow the allocation matrix. All constraints are kept as rows of A x <= b.
+    The stable marriage polytope is integral, so a model with only the matching and stability constraints is
+    solved as a continuous LP (dual simplex returns a vertex), added cuts switch the solve to a MIP.
+
+    With highspy installed the model stays resident in a HiGHS instance: cuts are appended as rows, LP re-solves
+    start from the previous basis, a fractional LP solution is re-solved as a MIP and MIP solves start from the
+    Gale Shapley matching.
+    """
+    num_extra_variables = 0
+    integral = False
+
+    def __init__(self, player_preference, worker_preference, N, name):
+        self.name = name
+        self.N = N
+        # preferences
+        self.player_preference = player_preference
+        self.worker_preference = worker_preference
+        self.ranking_player = get_rank_function(player_preference)
+        self.ranking_worker = get_rank_function(worker_preference)
+
+        self.num_variables = N * N + self.num_extra_variables
+        self.constraint_rows = []
+        self.constraint_upper = []
+        self.num_cuts = 0
+        self.x = None
+        self.status = 0
+        self.solver = None
+        self.solver_integral = False
+
+        self.objective = np.zeros(self.num_variables)
+        self.set_objective()
+        self.set_constraints()
+
+    def add_constraints(self, rows, upper):
+        """ add the rows A x <= upper, missing columns of rows are the extra variables """
+        rows = sparse.csr_matrix(rows)
+        rows.resize((rows.shape[0], self.num_variables))
+        self.constraint_rows.append(rows)
+        self.constraint_upper.append(np.asarray(upper, dtype=float))
+        if self.solver is not None:
+            self.add_solver_rows(rows, self.constraint_upper[-1])
+
+    def set_objective(self, **kwargs):
+        raise NotImplementedError("Please implement your platform method")
+
+    def set_base_constrains(self):
+        identity = sparse.identity(self.N, format="csr")
+        ones = np.ones((1, self.N))
+        # player_limit_p: sum_w x[p, w] <= 1 and worker_limit_w: sum_p x[p, w] <= 1
+        player_limit = sparse.kron(identity, ones)
+        worker_limit = sparse.kron(ones, identity)
+        self.add_constraints(sparse.vstack([player_limit, worker_limit]), np.ones(2 * self.N))
+
+    def set_stability_constraints(self):
+        """
+        blocking_p_w: x[p, w] + sum_{w' >_p w} x[p, w'] + sum_{p' >_w p} x[p', w] >= 1, written as <= -1
+        """
+        N = self.N
+        # mask[p, w, w'] if p weakly prefers w' to w (this includes x[p, w] itself)
+        player_block = self.ranking_player[:, None, :] <= self.ranking_player[:, :, None]
+        p, w, other_worker = np.nonzero(player_block)
+        rows = [p * N + w]
+        cols = [p * N + other_worker]
+        # mask[w, p, p'] if w strictly prefers p' to p
+        worker_block = self.ranking_worker[:, None, :] < self.ranking_worker[:, :, None]
+        w, p, other_player = np.nonzero(worker_block)
+        rows.append(p * N + w)
+        cols.append(other_player * N + w)
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        matrix = sparse.csr_matrix((-np.ones(rows.size), (rows, cols)), shape=(N * N, self.num_variables))
+        self.add_constraints(matrix, -np.ones(N * N))
+
+    def set_constraints(self, **kwargs):
+        raise NotImplementedError("Please implement your platform method")
+
+    def allocation(self):
+        return self.x[:self.N * self.N].reshape(self.N, self.N)
+
+    def set_exclude_solution_constrains(self, run):
+        # sum of the allocations of the current solution <= N - 1
+        row = np.zeros((1, self.num_variables))
+        row[0, :self.N * self.N] = self.allocation().ravel() > 0.5
+        self.add_constraints(row, [self.N - 1])
+        self.num_cuts += 1
+
+    def set_objective_cut(self, run):
+        # the objective can not get worse than the current solution
+        self.add_constraints(self.objective[None, :], [self.objective @ self.x])
+        self.num_cuts += 1
+
+    def set_additional_solution_constrains(self, run, **kwargs):
+        pass
+
+    def get_match(self):
+        return np.argmax(self.allocation(), axis=1).tolist()
+
+    def get_evaluation(self):
+        return 0
+
+    def warm_start_solution(self):
+        """ player optimal stable matching as a full solution vector """
+        x = np.zeros(self.num_variables)
+        match = stable_match(self.player_preference, self.worker_preference, mode=0)
+        x[np.arange(self.N) * self.N + match] = 1
+        return x
+
+    def build_solver(self):
+        self.solver = highspy.Highs()
+        self.solver.setOptionValue("output_flag", False)
+        lower, upper = self.variable_bounds()
+        columns = np.arange(self.num_variables, dtype=np.int32)
+        self.solver.addVars(self.num_variables, lower, upper)
+        self.solver.changeColsCost(self.num_variables, columns, self.objective)
+        for rows, upper in zip(self.constraint_rows, self.constraint_upper):
+            self.add_solver_rows(rows, upper)
+
+    def add_solver_rows(self, rows, upper):
+        self.solver.addRows(rows.shape[0], np.full(rows.shape[0], -np.inf), upper, rows.nnz,
+                            rows.indptr[:-1].astype(np.int32), rows.indices.astype(np.int32), rows.data)
+
+    def set_solver_integrality(self, integral):
+        if integral == self.solver_integral:
+            return
+        var_type = highspy.HighsVarType.kInteger if integral else highspy.HighsVarType.kContinuous
+        columns = np.arange(self.N * self.N, dtype=np.int32)
+        self.solver.changeColsIntegrality(columns.size, columns, np.array([var_type] * columns.size))
+        self.solver_integral = integral
+
+    def run_solver(self, integral):
+        self.set_solver_integrality(integral)
+        if integral:
+            warm_start = highspy.HighsSolution()
+            warm_start.col_value = self.warm_start_solution().tolist()
+            self.solver.setSolution(warm_start)  # ignored by HiGHS once a cut makes it infeasible
+        self.solver.run()
+        if self.solver.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+            return None
+        return np.array(self.solver.getSolution().col_value)
+
+    def solve_resident(self, time_limit=None):
+        if self.solver is None:
+            self.build_solver()
+        self.solver.setOptionValue("time_limit", np.inf if time_limit is None else float(time_limit))
+        x = self.run_solver(self.integral)
+        if x is not None and not self.integral:
+            allocation = x[:self.N * self.N]
+            if np.any(np.minimum(allocation, 1 - allocation) > 1e-6):
+                # the cuts made this relaxation fractional
+                x = self.run_solver(True)
+        self.status = 0 if x is None else 1
+        self.x = x
+
+    def solve(self, time_limit=None):
+        if highspy is not None:
+            return self.solve_resident(time_limit=time_limit)
+
+        A_ub = sparse.vstack(self.constraint_rows, format="csr")
+        b_ub = np.concatenate(self.constraint_upper)
+        options = {} if time_limit is None else {"time_limit": time_limit}
+        if self.integral or self.num_cuts > 0:
+            integrality = np.zeros(self.num_variables)
+            integrality[:self.N * self.N] = 1
+            lower, upper = self.variable_bounds()
+            result = milp(self.objective,
+                          constraints=LinearConstraint(A_ub, -np.inf, b_ub),
+                          integrality=integrality,
+                          bounds=Bounds(lower, upper),
+                          options=options)
+        else:
+            result = linprog(self.objective, A_ub=A_ub, b_ub=b_ub,
+                             bounds=np.stack(self.variable_bounds(), axis=1), method="highs-ds", options=options)
+        # status 1 for an optimal solution as in pulp
+        self.status = 1 if result.status == 0 else 0
+        self.x = result.x if self.status == 1 else None
+
+    def variable_bounds(self):
+        lower = np.zeros(self.num_variables)
+        upper = np.ones(self.num_variables)
+        upper[self.N * self.N:] = np.inf
+        return lower, upper
+
+    def run(self, runs=1, additional_exlution_constrains=1, max_solutions=None, time_limit=None, **kwargs):
+        """
+        runs=1 solves once, otherwise solutions are enumerated with exclusion cuts until the model becomes
+        infeasible, max_solutions are found or the time_limit (seconds) is spent
+        """
+        status = 1
+        matchings = []
+        evaluations = []
+        run = 1
+        start_time = time.time()
+        while status == 1:
+            remaining_time = None if time_limit is None else time_limit - (time.time() - start_time)
+            if remaining_time is not None and remaining_time <= 0:
+                break
+            self.solve(time_limit=remaining_time)
+
+            status = self.status
+
+            if status == 1:
+                # get matching
+                match = self.get_match()
+                evaluation = self.get_evaluation()
+                matchings.append(match)
+                evaluations.append(evaluation)
+
+                # add additional constrain to remove solution for all stable matching
+                self.set_exclude_solution_constrains(run)
+                if additional_exlution_constrains:  # otherwise get all evaluation for the stable matchings
+                    self.set_additional_solution_constrains(run)
+
+            if runs == 1 or (max_solutions is not None and len(matchings) >= max_solutions):
+                status = 0
+
+            run += 1
+
+        return matchings, evaluations
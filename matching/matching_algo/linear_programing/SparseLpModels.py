@@ -0,0 +1,137 @@
+import numpy as np
+from scipy import sparse
+
+from matching.matching_algo.linear_programing.SparseLinearModel import SparseLinearModel
+
+
+class SparseLpStableMatching(SparseLinearModel):
+    name = "SparseLpStableMatching"
+
+    def __init__(self, player_preference, worker_preference, N):
+        SparseLinearModel.__init__(self,
+                                   player_preference=player_preference,
+                                   worker_preference=worker_preference,
+                                   N=N,
+                                   name="SparseLpStableMatching")
+
+    def set_objective(self, **kwargs):
+        pass  # arbitrary objective function
+
+    def set_constraints(self, **kwargs):
+        self.set_base_constrains()
+        self.set_stability_constraints()
+
+
+class SparsePlayerOptimalStableMatching(SparseLinearModel):
+    name = "SparsePlayerOptimalStableMatching"
+
+    def __init__(self, player_preference, worker_preference, N):
+        SparseLinearModel.__init__(self,
+                                   player_preference,
+                                   worker_preference,
+                                   N,
+                                   name="SparsePlayerOptimalStableMatching")
+
+    def set_objective(self, **kwargs):
+        # x[p, w] * ranking_player[p][w]
+        self.objective[:self.N * self.N] = self.ranking_player.ravel()
+
+    def set_constraints(self, **kwargs):
+        self.set_base_constrains()
+        self.set_stability_constraints()
+
+    def set_additional_solution_constrains(self, run, **kwargs):
+        self.set_objective_cut(run)
+
+
+class SparseWorkerOptimalStableMatching(SparseLinearModel):
+    name = "SparseWorkerOptimalStableMatching"
+
+    def __init__(self, player_preference, worker_preference, N):
+        SparseLinearModel.__init__(self,
+                                   player_preference,
+                                   worker_preference,
+                                   N,
+                                   name="SparseWorkerOptimalStableMatching")
+
+    def set_objective(self, **kwargs):
+        # x[p, w] * ranking_worker[w][p]
+        self.objective[:self.N * self.N] = self.ranking_worker.T.ravel()
+
+    def set_constraints(self, **kwargs):
+        self.set_base_constrains()
+        self.set_stability_constraints()
+
+    def set_additional_solution_constrains(self, run, **kwargs):
+        self.set_objective_cut(run)
+
+
+class SparseEgalitarianStableMatch(SparseLinearModel):
+    name = "SparseEgalitarianStableMatch"
+
+    def __init__(self, player_preference, worker_preference, N):
+        SparseLinearModel.__init__(self,
+                                   player_preference,
+                                   worker_preference,
+                                   N,
+                                   name="SparseEgalitarianStableMatch")
+
+    def set_objective(self, **kwargs):
+        self.objective[:self.N * self.N] = (self.ranking_player + self.ranking_worker.T).ravel()
+
+    def set_constraints(self, **kwargs):
+        self.set_base_constrains()
+        self.set_stability_constraints()
+
+    def set_additional_solution_constrains(self, run, **kwargs):
+        self.set_objective_cut(run)
+
+
+class SparseSexEqualStableMatching(SparseLinearModel):
+    """
+    the absolute value makes the relaxation fractional, so the model is always solved as a MIP,
+    the extra variable t is the absolute rank difference
+    """
+    name = "SparseSexEqualStableMatching"
+    num_extra_variables = 1
+    integral = True
+
+    def __init__(self, player_preference, worker_preference, N, delta):
+        self.delta = delta
+        SparseLinearModel.__init__(self,
+                                   player_preference,
+                                   worker_preference,
+                                   N,
+                                   name="SparseSexEqualStableMatching")
+
+    def rank_difference(self):
+        return (self.ranking_player - self.ranking_worker.T).ravel()
+
+    def set_objective(self, **kwargs):
+        self.objective[-1] = 1
+
+    def set_abs_constrains(self):
+        # t >= diff x + delta and t >= -(diff x + delta)
+        diff = self.rank_difference()
+        rows = np.zeros((2, self.num_variables))
+        rows[0, :self.N * self.N], rows[1, :self.N * self.N] = diff, -diff
+        rows[:, -1] = -1
+        self.add_constraints(sparse.csr_matrix(rows), [-self.delta, self.delta])
+
+    def set_constraints(self, **kwargs):
+        self.set_base_constrains()
+        self.set_stability_constraints()
+        self.set_abs_constrains()
+
+    def warm_start_solution(self):
+        x = SparseLinearModel.warm_start_solution(self)
+        x[-1] = abs(self.rank_difference() @ x[:-1] + self.delta)
+        return x
+
+    def set_additional_solution_constrains(self, run, **kwargs):
+        diff = self.rank_difference()
+        current_diff = abs(diff @ self.allocation().ravel() + self.delta)
+        rows = np.zeros((2, self.num_variables))
+        rows[0, :self.N * self.N], rows[1, :self.N * self.N] = diff, -diff
+        self.add_constraints(sparse.csr_matrix(rows), [current_diff - self.delta, current_diff + self.delta])
+        self.num_cuts += 1
@@ -0,0 +1,124 @@
+"""
+Optimal stable matchings through the rotation poset, combinatorial counterparts of the LpModels classes that run
+in-process in polynomial time.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_flow, breadth_first_order
+
+from matching.matching_algo.gale_shapley import stable_match
+from matching.matching_algo.rotation_poset import RotationPoset
+
+
+def rotation_weights(poset):
+    """
+    change of the egalitarian cost (sum of the ranks of both sides) when each rotation is eliminated
+    """
+    weights = np.zeros(len(poset), dtype=np.int64)
+    for rotation_id, rotation in enumerate(poset.rotations):
+        players, arms = rotation[:, 0], rotation[:, 1]
+        new_arms = np.roll(arms, -1)
+        next_players = np.roll(players, -1)
+        player_change = poset.player_ranks[players, new_arms] - poset.player_ranks[players, arms]
+        # new_arms[i] leaves next_players[i] for players[i]
+        arm_change = poset.arm_ranks[new_arms, players] - poset.arm_ranks[new_arms, next_players]
+        weights[rotation_id] = player_change.sum() + arm_change.sum()
+    return weights
+
+
+def minimum_weight_closure(weights, predecessors):
+    """
+    set of rotations closed under predecessors with minimum total weight, solved as a minimum s-t cut:
+    rotations of the source side are eliminated
+    """
+    num_rotations = len(weights)
+    if num_rotations == 0:
+        return []
+    source, sink = num_rotations, num_rotations + 1
+    infinity = int(np.abs(weights).sum()) + 1
+
+    rows, cols, capacities = [], [], []
+    for rotation_id, weight in enumerate(weights):
+        if weight < 0:
+            rows.append(source), cols.append(rotation_id), capacities.append(-weight)
+        elif weight > 0:
+            rows.append(rotation_id), cols.append(sink), capacities.append(weight)
+        for previous in predecessors[rotation_id]:
+            rows.append(rotation_id), cols.append(previous), capacities.append(infinity)
+    graph = csr_matrix((np.array(capacities, dtype=np.int32), (rows, cols)),
+                       shape=(num_rotations + 2, num_rotations + 2))
+
+    flow = maximum_flow(graph, source, sink).flow
+    residual = (graph - flow).tocsr()
+    residual.data[residual.data < 0] = 0
+    residual.eliminate_zeros()
+    reachable = breadth_first_order(residual, source, directed=True, return_predecessors=False)
+    return sorted(node for node in reachable.tolist() if node < num_rotations)
+
+
+def player_optimal_stable_match(player_preference, worker_preference, N):
+    """
+    stable matching minimising the sum of the player ranks, same objective as PlayerOptimalStableMatching
+    """
+    return stable_match(player_preference, worker_preference, mode=0).tolist()
+
+
+def egalitarian_stable_match(player_preference, worker_preference, N, poset=None):
+    """
+    stable matching minimising the sum of the ranks of both sides, same objective as EgalitarianStableMatch
+    """
+    if poset is None:
+        poset = RotationPoset(player_preference, worker_preference)
+    assert poset.num_players == N
+    closure = minimum_weight_closure(rotation_weights(poset), poset.predecessors)
+    return poset.matching_of(closure).tolist()
+
+
+def minimum_regret_stable_match(player_preference, worker_preference, N, poset=None):
+    """
+    stable matching minimising the largest rank any agent gets (Gusfield).
+
+    Starting from the player optimal matching, while the largest rank belongs to an arm, every better matching
+    has to give this arm a new partner, so the rotation moving it away from its partner and all the rotations
+    preceding it are eliminated. Players only get worse along the way, so we stop once the largest rank belongs
+    to a player and return the best matching that was visited.
+    """
+    if poset is None:
+        poset = RotationPoset(player_preference, worker_preference)
+    assert poset.num_players == N
+    players = np.arange(N)
+    rotation_of = {}
+    for rotation_id, rotation in enumerate(poset.rotations):
+        for player, arm in rotation.tolist():
+            rotation_of[player, arm] = rotation_id
+
+    eliminated = np.zeros(len(poset), dtype=bool)
+    matching = poset.player_optimal.copy()
+    best_matching, best_regret = matching.copy(), np.inf
+    while True:
+        arm_partner = np.empty(N, dtype=np.int64)
+        arm_partner[matching] = players
+        player_regret = poset.player_ranks[players, matching]
+        arm_regret = poset.arm_ranks[players, arm_partner]
+        regret = max(player_regret.max(), arm_regret.max())
+        if regret < best_regret:
+            best_matching, best_regret = matching.copy(), regret
+        if arm_regret.max() <= player_regret.max():
+            break
+        arm = int(np.argmax(arm_regret))
+        rotation_id = rotation_of.get((int(arm_partner[arm]), arm))
+        if rotation_id is None:  # the arm is already matched to its best stable partner
+            break
+
+        # eliminate the rotation and its uneliminated ancestors, rotation ids are a topological order
+        ancestors, stack = {rotation_id}, [rotation_id]
+        while stack:
+            for previous in poset.predecessors[stack.pop()]:
+                if not eliminated[previous] and previous not in ancestors:
+                    ancestors.add(previous)
+                    stack.append(previous)
+        for ancestor in sorted(ancestors):
+            rotation = poset.rotations[ancestor]
+            matching[rotation[:, 0]] = np.roll(rotation[:, 1], -1)
+            eliminated[ancestor] = True
+    return best_matching.tolist()
@@ -0,0 +1,230 @@
+"""
+Rotation poset of a stable marriage instance (Irving-Leather, Gusfield).
+
+The stable matchings are in one-to-one correspondence with the closed subsets of the rotation poset, the
+player optimal matching being the empty set and the arm optimal matching the set of all rotations. The poset is
+built in O(n^2) from the outputs of Gale Shapley from both sides and the closed subsets are enumerated lazily,
+so the lattice can be explored without looking at the N! matchings.
+"""
+import numpy as np
+
+from matching.matching_algo.gale_shapley import gale_shapley_ranks
+from matching.matching_algo.is_stable import batch_is_stable
+from matching.utils import preferences_to_ranks
+
+
+class RotationPoset(object):
+    """
+    Rotations of the instance and their precedence relation.
+
+    - rotations[r] is a (k, 2) array of the pairs (player, arm) of rotation r, eliminating it moves every player
+      to the arm of the next player in the rotation
+    - predecessors[r] / successors[r] are the rotations that explicitly precede / succeed r
+    """
+
+    def __init__(self, players_ranking, arms_rankings):
+        self.player_preferences = np.asarray(players_ranking, dtype=np.int64)
+        self.arm_preferences = np.asarray(arms_rankings, dtype=np.int64)
+        self.num_players = self.player_preferences.shape[0]
+        self.player_ranks = preferences_to_ranks(self.player_preferences)
+        self.arm_ranks = preferences_to_ranks(self.arm_preferences)
+
+        self.player_optimal, _ = gale_shapley_ranks(self.player_preferences, self.arm_ranks)
+        _, self.arm_optimal = gale_shapley_ranks(self.arm_preferences, self.player_ranks)
+
+        self.rotations = []
+        # moved_to[p][a] the rotation that moves player p to arm a, arm_history[a] the (rotation, new partner)
+        self.moved_to = [[-1] * self.num_players for _ in range(self.num_players)]
+        self.arm_history = [[] for _ in range(self.num_players)]
+        self.find_rotations()
+        self.predecessors, self.successors = self.build_precedence()
+
+    def find_rotations(self):
+        """
+        eliminate exposed rotations from the player optimal matching until the arm optimal matching is reached,
+        every rotation is eliminated exactly once on the way
+        """
+        preferences = self.player_preferences.tolist()
+        arm_ranks = self.arm_ranks.tolist()
+        player_ranks = self.player_ranks.tolist()
+        target = self.arm_optimal.tolist()
+        matching = self.player_optimal.tolist()
+        arm_partner = [0] * self.num_players
+        for player, arm in enumerate(matching):
+            arm_partner[arm] = player
+        # the arms before pointer[p] in the list of p never accept p again as arm partners only improve
+        pointer = [player_ranks[player][matching[player]] + 1 for player in range(self.num_players)]
+        stack_position = [-1] * self.num_players
+
+        def next_arm(player):
+            # s(p): first arm after the partner of p that prefers p to its own partner
+            while True:
+                arm = preferences[player][pointer[player]]
+                if arm_ranks[arm][player] < arm_ranks[arm][arm_partner[arm]]:
+                    return arm
+                pointer[player] += 1
+
+        for start in range(self.num_players):
+            while matching[start] != target[start]:
+                stack = [start]
+                stack_position[start] = 0
+                while stack:
+                    player = stack[-1]
+                    successor = arm_partner[next_arm(player)]
+                    if stack_position[successor] == -1:
+                        stack_position[successor] = len(stack)
+                        stack.append(successor)
+                        continue
+
+                    # the walk closed a cycle, this is an exposed rotation
+                    cycle = stack[stack_position[successor]:]
+                    del stack[stack_position[successor]:]
+                    rotation_id = len(self.rotations)
+                    self.rotations.append(np.array([(player, matching[player]) for player in cycle], dtype=np.int64))
+                    new_arms = [matching[cycle[(i + 1) % len(cycle)]] for i in range(len(cycle))]
+                    for player, arm in zip(cycle, new_arms):
+                        stack_position[player] = -1
+                        matching[player] = arm
+                        arm_partner[arm] = player
+                        pointer[player] += 1
+                        self.moved_to[player][arm] = rotation_id
+                        self.arm_history[arm].append((rotation_id, player))
+
+    def build_precedence(self):
+        """
+        explicit precedence relation of the rotations:
+        1. the rotation that moves p to a precedes the rotation that contains (p, a)
+        2. if rotation r moves p from a to a', every arm w strictly between a and a' in the list of p must hold a
+           player it prefers to p, so the rotation moving w from a worse to a better player than p precedes r
+        """
+        num_rotations = len(self.rotations)
+        arm_ranks = self.arm_ranks.tolist()
+        player_ranks = self.player_ranks.tolist()
+        preferences = self.player_preferences.tolist()
+
+        # crossing[w][r] the rotation that moves arm w from a player of rank > r to a player of rank < r
+        worst_partner = np.empty(self.num_players, dtype=np.int64)
+        worst_partner[self.player_optimal] = np.arange(self.num_players)
+        crossing = []
+        for arm in range(self.num_players):
+            history = self.arm_history[arm]
+            partner_ranks = [arm_ranks[arm][player] for _, player in history]
+            row = [-1] * self.num_players
+            entry = 0
+            for rank in range(arm_ranks[arm][worst_partner[arm]] - 1, -1, -1):
+                while entry < len(history) and partner_ranks[entry] >= rank:
+                    entry += 1
+                row[rank] = history[entry][0] if entry < len(history) else -1
+            crossing.append(row)
+
+        predecessors = [set() for _ in range(num_rotations)]
+        for rotation_id, rotation in enumerate(self.rotations):
+            pairs = rotation.tolist()
+            for i, (player, arm) in enumerate(pairs):
+                # type 1
+                previous = self.moved_to[player][arm]
+                if previous != -1:
+                    predecessors[rotation_id].add(previous)
+                # type 2
+                new_arm = pairs[(i + 1) % len(pairs)][1]
+                for position in range(player_ranks[player][arm] + 1, player_ranks[player][new_arm]):
+                    between = preferences[player][position]
+                    previous = crossing[between][arm_ranks[between][player]]
+                    if previous != -1:
+                        predecessors[rotation_id].add(previous)
+            predecessors[rotation_id].discard(rotation_id)
+
+        successors = [[] for _ in range(num_rotations)]
+        for rotation_id in range(num_rotations):
+            for previous in predecessors[rotation_id]:
+                successors[previous].append(rotation_id)
+        return [sorted(previous) for previous in predecessors], successors
+
+    def __len__(self):
+        return len(self.rotations)
+
+    def matching_of(self, rotation_ids):
+        """
+        stable matching obtained by eliminating a closed subset of rotations
+        """
+        matching = self.player_optimal.copy()
+        eliminated = np.zeros(len(self.rotations), dtype=bool)
+        eliminated[list(rotation_ids)] = True
+        for rotation_id in np.nonzero(eliminated)[0]:
+            # players only move down their lists, so the final partner of a player is its worst new arm
+            rotation = self.rotations[rotation_id]
+            players, arms = rotation[:, 0], np.roll(rotation[:, 1], -1)
+            move = self.player_ranks[players, arms] > self.player_ranks[players, matching[players]]
+            matching[players[move]] = arms[move]
+        return matching
+
+    def iter_stable_matchings(self):
+        """
+        lazily enumerate every stable matching exactly once.
+
+        Depth first search over the closed subsets: at every node the exposed rotations are eliminated one at a
+        time, and a rotation that has been explored in a branch is forbidden in the following branches.
+        """
+        num_rotations = len(self.rotations)
+        matching = self.player_optimal.copy()
+        unmet = [len(previous) for previous in self.predecessors]
+        exposed = {rotation_id for rotation_id in range(num_rotations) if unmet[rotation_id] == 0}
+        forbidden = [False] * num_rotations
+        pairs = [rotation.tolist() for rotation in self.rotations]
+
+        def eliminate(rotation_id):
+            rotation = pairs[rotation_id]
+            for i, (player, _) in enumerate(rotation):
+                matching[player] = rotation[(i + 1) % len(rotation)][1]
+            exposed.discard(rotation_id)
+            for successor in self.successors[rotation_id]:
+                unmet[successor] -= 1
+                if unmet[successor] == 0:
+                    exposed.add(successor)
+
+        def undo(rotation_id):
+            for successor in self.successors[rotation_id]:
+                if unmet[successor] == 0:
+                    exposed.discard(successor)
+                unmet[successor] += 1
+            for player, arm in pairs[rotation_id]:
+                matching[player] = arm
+            exposed.add(rotation_id)
+
+        def candidates():
+            return sorted(rotation_id for rotation_id in exposed if not forbidden[rotation_id])
+
+        yield matching.copy()
+        # every frame holds the candidates of a node and the number of branches already started
+        stack = [[candidates(), 0]]
+        while stack:
+            frame = stack[-1]
+            branches, started = frame
+            if started > 0:
+                # back from the branch of the previous candidate
+                undo(branches[started - 1])
+                forbidden[branches[started - 1]] = True
+            if started < len(branches):
+                frame[1] += 1
+                eliminate(branches[started])
+                yield matching.copy()
+                stack.append([candidates(), 0])
+            else:
+                for rotation_id in branches:
+                    forbidden[rotation_id] = False
+                stack.pop()
+
+    def count_stable_matchings(self):
+        return sum(1 for _ in self.iter_stable_matchings())
+
+    def is_stable_matching(self, matching):
+        return bool(batch_is_stable([matching], player_ranks=self.player_ranks, arm_ranks=self.arm_ranks)[0])
+
+
+def all_stable_matching_rotations(players_ranking, arms_rankings, num_players):
+    """
+    same output as all_stable_matching_brute_force, sorted in lexicographic order
+    """
+    poset = RotationPoset(players_ranking, arms_rankings)
+    assert poset.num_players == num_players
+    return sorted(tuple(matching.tolist()) for matching in poset.iter_stable_matchings())
@@ -1,8 +1,16 @@
 from matching.matching_algo.find_all_matchings import find_all_matchings
-from matching.utils import inv_matching, fix_preferences, calculate_delta_rank
+from matching.utils import inv_matching, fix_preferences, calculate_delta_rank, preferences_to_ranks
 from matching.matching_algo.find_all_stable_matching_brute_force import all_stable_matching_brute_force
-from matching.matching_algo.gale_shapley import gale_shapley_algo
-from matching.matching_algo.is_stable import is_unstable
+from matching.matching_algo.gale_shapley import gale_shapley_algo, stable_match, gale_shapley_ranks
+from matching.matching_algo.incremental_gale_shapley import IncrementalGaleShapley
+from matching.matching_algo.rotation_poset import RotationPoset, all_stable_matching_rotations
+from matching.matching_algo.optimal_stable_matching import egalitarian_stable_match, minimum_regret_stable_match
+from matching.matching_algo.is_stable import is_unstable, batch_is_stable
+from matching.matching_algo.coloring.minimum_edge_coloring import get_matchings_edge_coloring, IncrementalEdgeColoring
+from matching.cetralised_platforms.pac.elimination_kernel import overlap_counts
+from matching.matching_algo.linear_programing.SparseLpModels import SparseLpStableMatching, \
+    SparseEgalitarianStableMatch, SparsePlayerOptimalStableMatching, SparseSexEqualStableMatching
+from matching.matching_algo.linear_programing import SparseLinearModel as sparse_linear_model
 import numpy as np
 
 
@@ -169,4 +177,301 @@ def test_bug():
     print(unstable)
 
 
+def test_gale_shapley_sides():
+    """
+    the rank based engine returns the player optimal and pessimal matchings of the brute force solution
+    """
+    rng = np.random.default_rng(0)
+    num_players_test = 5
+    for _ in range(20):
+        players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+        arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+        matchings = all_stable_matching_brute_force(players_ranking=players_ranking_test,
+                                                    arms_rankings=arm_ranking_test,
+                                                    num_players=num_players_test)
+        player_ranks = [sum(players_ranking_test[p].index(a) for p, a in enumerate(m)) for m in matchings]
+        optimal = stable_match(players_ranking_test, arm_ranking_test, mode=0)
+        pessimal = stable_match(players_ranking_test, arm_ranking_test, mode=1)
+        assert tuple(optimal) == matchings[int(np.argmin(player_ranks))]
+        assert tuple(pessimal) == matchings[int(np.argmax(player_ranks))]
+    print("End")
+
+
+def test_batch_is_stable():
+    """
+    the batch checker agrees with is_unstable and its blocking pairs are the pairs that block each matching
+    """
+    players_ranking_test = [[0, 1, 2], [2, 0, 1], [1, 2, 0]]
+    arm_ranking_test = [[2, 1, 0], [1, 0, 2], [0, 2, 1]]
+    num_players_test = 3
+    matchings = np.array(find_all_matchings(num_of_players=num_players_test))
+    player_ranks = preferences_to_ranks(players_ranking_test)
+    arm_ranks = preferences_to_ranks(arm_ranking_test)
+    stable, blocking = batch_is_stable(matchings, player_ranks, arm_ranks, return_blocking_pairs=True)
+    for matching, flag, mask in zip(matchings, stable, blocking):
+        unstable = is_unstable(arm_matching=matching.tolist(),
+                               players_ranking=arm_ranking_test,
+                               arms_rankings=players_ranking_test,
+                               num_players=num_players_test)
+        assert flag == (not unstable)
+        for player, arm in zip(*np.nonzero(mask)):
+            assert player_ranks[player, arm] < player_ranks[player, matching[player]]
+            assert arm_ranks[arm, player] < arm_ranks[arm, list(matching).index(arm)]
+    assert stable.sum() == 3
+    assert not batch_is_stable([[0, 0, 1]], player_ranks, arm_ranks)[0]
+    print("End")
+
+
+def test_rotation_poset():
+    """
+    the closed subsets of the rotation poset are the stable matchings found by brute force
+    """
+    rng = np.random.default_rng(0)
+    for num_players_test in [3, 5, 7]:
+        for _ in range(20):
+            players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            matchings = all_stable_matching_brute_force(players_ranking=players_ranking_test,
+                                                        arms_rankings=arm_ranking_test,
+                                                        num_players=num_players_test)
+            assert matchings == all_stable_matching_rotations(players_ranking_test,
+                                                              arm_ranking_test,
+                                                              num_players_test)
+
+    # example 3.1 with 6 stable matchings
+    players_ranking_test = [[0, 2, 1, 3, 4], [1, 2, 0, 3, 4], [2, 1, 0, 3, 4], [3, 4, 0, 1, 2], [4, 3, 0, 1, 2]]
+    arm_ranking_test = [[1, 0, 2, 3, 4], [2, 1, 0, 3, 4], [0, 1, 2, 3, 4], [4, 3, 0, 1, 2], [3, 4, 0, 1, 2]]
+    poset = RotationPoset(players_ranking_test, arm_ranking_test)
+    print(f"rotations: {[rotation.tolist() for rotation in poset.rotations]}")
+    assert poset.count_stable_matchings() == 6
+    print("End")
+
+
+def test_optimal_stable_matching():
+    """
+    egalitarian and minimum regret stable matchings reach the best value over all stable matchings
+    """
+    rng = np.random.default_rng(1)
+    num_players_test = 6
+    for _ in range(30):
+        players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+        arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+        player_ranks = preferences_to_ranks(players_ranking_test)
+        arm_ranks = preferences_to_ranks(arm_ranking_test)
+        players = np.arange(num_players_test)
+        matchings = all_stable_matching_brute_force(players_ranking=players_ranking_test,
+                                                    arms_rankings=arm_ranking_test,
+                                                    num_players=num_players_test)
+
+        def total_rank(matching):
+            return (player_ranks[players, matching] + arm_ranks[matching, players]).sum()
+
+        def regret(matching):
+            return max(player_ranks[players, matching].max(), arm_ranks[matching, players].max())
+
+        egalitarian = egalitarian_stable_match(players_ranking_test, arm_ranking_test, num_players_test)
+        minimum_regret = minimum_regret_stable_match(players_ranking_test, arm_ranking_test, num_players_test)
+        assert tuple(egalitarian) in matchings and tuple(minimum_regret) in matchings
+        assert total_rank(list(egalitarian)) == min(total_rank(list(matching)) for matching in matchings)
+        assert regret(list(minimum_regret)) == min(regret(list(matching)) for matching in matchings)
+    print("End")
+
+
+def test_edge_coloring():
+    """
+    the colour classes are max degree matchings that cover every available pair once
+    """
+    rng = np.random.default_rng(2)
+    num_players_test = 8
+    for _ in range(30):
+        adjacency_matrix = (rng.random((num_players_test, num_players_test)) < rng.random()).astype(int)
+        max_degree = max(adjacency_matrix.sum(axis=0).max(), adjacency_matrix.sum(axis=1).max())
+        matchings = get_matchings_edge_coloring(num_players=num_players_test, adjacency_matrix=adjacency_matrix)
+        assert matchings.shape == (max_degree, num_players_test, 2)
+        covered = np.zeros_like(adjacency_matrix)
+        for matching in matchings:
+            matching = matching[matching[:, 1] >= 0]
+            assert len(set(matching[:, 1].tolist())) == len(matching)
+            covered[matching[:, 0], matching[:, 1]] += 1
+        assert np.array_equal(covered, adjacency_matrix)
+    print("End")
+
+
+def test_incremental_edge_coloring():
+    """
+    repaired colourings stay minimum while pairs are eliminated round after round
+    """
+    rng = np.random.default_rng(3)
+    num_players_test = 8
+    adjacency_matrix = np.ones((num_players_test, num_players_test), dtype=int)
+    coloring = IncrementalEdgeColoring(num_players=num_players_test)
+    while adjacency_matrix.any():
+        matchings = coloring.update(adjacency_matrix)
+        max_degree = max(adjacency_matrix.sum(axis=0).max(), adjacency_matrix.sum(axis=1).max())
+        assert len(matchings) == max_degree
+        covered = np.zeros_like(adjacency_matrix)
+        for matching in matchings:
+            matching = matching[matching[:, 1] >= 0]
+            assert len(set(matching[:, 1].tolist())) == len(matching)
+            covered[matching[:, 0], matching[:, 1]] += 1
+        assert np.array_equal(covered, adjacency_matrix)
+        adjacency_matrix = adjacency_matrix * (rng.random(adjacency_matrix.shape) > 0.1)
+    print("End")
+
+
+def test_overlap_counts():
+    """
+    the vectorized overlap counts match the pairwise interval test, NaN intervals overlapping everything
+    """
+    rng = np.random.default_rng(4)
+    for _ in range(200):
+        num_players_test = rng.integers(1, 8)
+        centers = rng.integers(0, 5, (num_players_test, num_players_test)) / 4
+        widths = rng.integers(0, 3, (num_players_test, num_players_test)) / 4
+        lower, upper = centers - widths, centers + widths
+        undefined = rng.random(lower.shape) < 0.1
+        lower[undefined], upper[undefined] = np.nan, np.nan
+        members = rng.random(lower.shape) < 0.7
+        counts = overlap_counts(lower, upper, members)
+        for player in range(num_players_test):
+            for arm in range(num_players_test):
+                expected = sum(not (upper[player, arm] < lower[player, other] or
+                                    lower[player, arm] > upper[player, other])
+                               for other in range(num_players_test) if other != arm and members[player, other])
+                assert counts[player, arm] == expected
+    print("End")
+
+
+def test_incremental_gale_shapley():
+    """
+    warm-started update and rewind give the player optimal matching of deferred acceptance from scratch while
+    the preferences of a few players are perturbed
+    """
+    rng = np.random.default_rng(5)
+    for num_players_test in [2, 5, 12]:
+        player_preferences = np.array([rng.permutation(num_players_test) for _ in range(num_players_test)])
+        arm_ranks = preferences_to_ranks([rng.permutation(num_players_test) for _ in range(num_players_test)])
+        matcher = IncrementalGaleShapley(player_preferences=player_preferences, arm_ranks=arm_ranks)
+        for step in range(100):
+            changed_players = rng.choice(num_players_test, size=rng.integers(1, 3), replace=False)
+            for player in changed_players:
+                # swap two arms of the list of the player
+                first, second = rng.choice(num_players_test, size=2, replace=False)
+                player_preferences[player, [first, second]] = player_preferences[player, [second, first]]
+            expected, _ = gale_shapley_ranks(player_preferences, arm_ranks)
+            # half of the updates give the changed players, the others detect them
+            match = matcher.update(player_preferences, changed_players=changed_players if step % 2 else None)
+            assert np.array_equal(match, expected)
+
+            # undoing part of the log and proposing again gives the same matching
+            matcher.rewind(rng.integers(0, len(matcher.proposal_log) + 1))
+            matcher.propose()
+            assert np.array_equal(matcher.get_match(), expected)
+    print("End")
+
+
+def test_sparse_linear_model():
+    """
+    the stable matchings enumerated with exclusion cuts are the ones found by brute force, the egalitarian model
+    reaches the lowest total rank and the player optimal model the Gale Shapley matching
+    """
+    rng = np.random.default_rng(6)
+    for num_players_test in [3, 4, 5]:
+        for _ in range(10):
+            players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            player_ranks = preferences_to_ranks(players_ranking_test)
+            arm_ranks = preferences_to_ranks(arm_ranking_test)
+            players = np.arange(num_players_test)
+            matchings = all_stable_matching_brute_force(players_ranking=players_ranking_test,
+                                                        arms_rankings=arm_ranking_test,
+                                                        num_players=num_players_test)
+
+            model = SparseLpStableMatching(players_ranking_test, arm_ranking_test, num_players_test)
+            enumerated, _ = model.run(runs=0, additional_exlution_constrains=0)
+            assert len(enumerated) == len(matchings)
+            assert set(tuple(matching) for matching in enumerated) == set(matchings)
+
+            best_total_rank = min((player_ranks[players, list(matching)] +
+                                   arm_ranks[list(matching), players]).sum() for matching in matchings)
+            model = SparseEgalitarianStableMatch(players_ranking_test, arm_ranking_test, num_players_test)
+            (egalitarian,), _ = model.run()
+            assert tuple(egalitarian) in matchings
+            assert (player_ranks[players, egalitarian] + arm_ranks[egalitarian, players]).sum() == best_total_rank
+            assert np.isclose(model.objective @ model.x, best_total_rank)
+
+            model = SparsePlayerOptimalStableMatching(players_ranking_test, arm_ranking_test, num_players_test)
+            (player_optimal,), _ = model.run()
+            assert player_optimal == list(stable_match(players_ranking_test, arm_ranking_test, mode=0))
+    print("End")
+
+
+def test_sparse_linear_model_backends():
+    """
+    the resident HiGHS model (rows appended to the solver, LP re-solved as a MIP once the cuts make it fractional,
+    MIP warm started from Gale Shapley) and the scipy models rebuilt at every solve find the same solutions,
+    max_solutions and time_limit stop the enumeration
+    """
+    highspy = sparse_linear_model.highspy
+    rng = np.random.default_rng(7)
+    for num_players_test in [4, 6]:
+        for _ in range(5):
+            players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            results = {}
+            for backend in ["highspy", "scipy"] if highspy is not None else ["scipy"]:
+                sparse_linear_model.highspy = highspy if backend == "highspy" else None
+                try:
+                    model = SparseLpStableMatching(players_ranking_test, arm_ranking_test, num_players_test)
+                    enumerated, _ = model.run(runs=0, additional_exlution_constrains=0)
+                    if backend == "highspy":
+                        # every row was added to the resident solver, the last solves were MIPs
+                        assert model.solver.getNumRow() == sum(rows.shape[0] for rows in model.constraint_rows)
+                        assert model.solver_integral == (len(enumerated) > 1)
+                    egalitarian_model = SparseEgalitarianStableMatch(players_ranking_test, arm_ranking_test,
+                                                                     num_players_test)
+                    egalitarian, _ = egalitarian_model.run(runs=0)
+                    sex_equal_model = SparseSexEqualStableMatching(players_ranking_test, arm_ranking_test,
+                                                                   num_players_test, delta=0)
+                    # the warm start is a feasible solution of the model
+                    warm_start = sex_equal_model.warm_start_solution()
+                    for rows, upper in zip(sex_equal_model.constraint_rows, sex_equal_model.constraint_upper):
+                        assert np.all(rows @ warm_start <= upper + 1e-9)
+                    sex_equal_model.run()
+                    limited, _ = SparseLpStableMatching(players_ranking_test, arm_ranking_test,
+                                                        num_players_test).run(runs=0, max_solutions=2)
+                    timed_out, _ = SparseLpStableMatching(players_ranking_test, arm_ranking_test,
+                                                          num_players_test).run(runs=0, time_limit=0)
+                finally:
+                    sparse_linear_model.highspy = highspy
+                assert len(limited) == min(2, len(enumerated)) and timed_out == []
+                results[backend] = (tuple(sorted(map(tuple, enumerated))), tuple(sorted(map(tuple, egalitarian))),
+                                    round(sex_equal_model.objective @ sex_equal_model.x, 6))
+            assert len(set(results.values())) == 1
+    print("End")
+
+
+def test_stable_matchings_backtracking():
+    """
+    the pruned backtracking, in one process or sharded over a pool, gives the stable matchings of the unpruned
+    enumeration of every matching in the same lexicographic order
+    """
+    rng = np.random.default_rng(8)
+    for num_players_test in [1, 2, 4, 6]:
+        all_matchings = np.array(find_all_matchings(num_players_test))
+        for _ in range(10):
+            players_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            arm_ranking_test = [rng.permutation(num_players_test).tolist() for _ in range(num_players_test)]
+            stable = batch_is_stable(all_matchings,
+                                     player_ranks=preferences_to_ranks(players_ranking_test),
+                                     arm_ranks=preferences_to_ranks(arm_ranking_test))
+            expected = [tuple(matching) for matching in all_matchings[stable].tolist()]
+            for processes in [1, 2]:
+                assert expected == all_stable_matching_brute_force(players_ranking=players_ranking_test,
+                                                                   arms_rankings=arm_ranking_test,
+                                                                   num_players=num_players_test,
+                                                                   processes=processes)
+    print("End")
+
+
 test_3()
@@ -37,9 +37,14 @@ def calculate_delta_rank(matching, true_player_preferences, true_arm_preferences
 
 def get_rank_function(preferences):
     pref = np.array(preferences)
-    rank = np.zeros(pref.shape)
-    for player in range(pref.shape[0]):
-        for position, arm in enumerate(pref[player, :]):
-            rank[player, arm] = position
+    # rank[player, arm] = position of arm in the preference list of player
+    rank = np.argsort(pref, axis=1).astype(float)
     return rank
 
+
+def preferences_to_ranks(preferences):
+    """
+    rank matrix of a preference profile, rank[i, j] is the position of j in the preference list of i.
+    Works for a single (N, N) profile or a stack of profiles (..., N, N).
+    """
+    return np.argsort(np.asarray(preferences), axis=-1).astype(np.int64)